@@ -0,0 +1,154 @@
+"""
+How often the terminal of a client repaints, and how many of those repaints
+show a frame partially drawn, with and without synchronized output.
+
+A terminal reads what the application writes to its pseudo terminal in
+pieces, and repaints after handling a read. A frame that arrives in several
+reads is shown half drawn in between. Inside a synchronized update (DEC mode
+2026), the terminal waits for the end of the update instead.
+
+For every workload of `benchmarks.suite`, the frames of the repaint run are
+rendered, with a full repaint (like after attaching) after every
+`FULL_REPAINT_INTERVAL` frames. A child process writes every frame to a
+pseudo terminal with one write, like the client does, one frame every
+`FRAME_INTERVAL`. The other side is read in reads of at most `READ_SIZE`
+bytes, while counting the repaints that a terminal would do.
+
+Run from the root of the repository:
+
+    python -m benchmarks.frames
+"""
+from libpymux.invalidate import Redraw
+
+from benchmarks.keystroke import NullRenderer, repaint
+from benchmarks.suite import DEFAULT_SIZE, create_session, get_workloads
+
+import codecs
+import logging
+import os
+import time
+import tty
+
+#: Read size of the terminal.
+READ_SIZE = 4096
+
+FULL_REPAINT_INTERVAL = 10
+
+#: Time between two frames. (Like the frame rate cap of a session.)
+FRAME_INTERVAL = 1. / 30
+
+BEGIN_SYNC = b'\033[?2026h'
+END_SYNC = b'\033[?2026l'
+
+
+class FrameRenderer(NullRenderer):
+    """ Renderer that keeps every frame. """
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self.frames = []
+
+    def write_frame(self, data):
+        self.frames.append(data)
+        return super().write_frame(data)
+
+
+def render_frames(workload, synchronized_output):
+    session, window, renderer = create_session(workload.panes)
+    renderer = FrameRenderer(renderer.get_client, renderer.size)
+    renderer.supports_synchronized_output = synchronized_output
+    session.renderers[:] = [renderer]
+    repaint(session, Redraw.All)
+
+    panes = list(window.panes)
+    frames = [ workload.get_frames(i) for i in range(len(panes)) ]
+    decoders = [ codecs.getincrementaldecoder('utf-8')(errors='replace') for _ in panes ]
+
+    for f in range(len(frames[0])):
+        for pane, pane_frames, decoder in zip(panes, frames, decoders):
+            pane.write_output(decoder.decode(pane_frames[f]))
+
+        if f % FULL_REPAINT_INTERVAL == 0:
+            parts = Redraw.All
+        else:
+            parts = session._invalidate_parts | Redraw.Panes
+        repaint(session, parts)
+
+    return renderer.frames
+
+
+def count_repaints(frames):
+    """
+    Write the frames to a pseudo terminal and read them. Return the amount of
+    repaints, and the amount of repaints that show a frame partially.
+    """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            for frame in frames:
+                os.write(slave, frame)
+                time.sleep(FRAME_INTERVAL)
+        finally:
+            os._exit(0)
+
+    # Offsets at which a frame ends.
+    ends = set()
+    total = 0
+    for frame in frames:
+        total += len(frame)
+        ends.add(total)
+
+    repaints = partial = 0
+    received = 0
+    in_sync = False
+    tail = b''
+
+    while received < total:
+        data = os.read(master, READ_SIZE)
+        received += len(data)
+
+        # Keep track of synchronized updates. (The sequences can be split
+        # over two reads.)
+        data = tail + data
+        begin, end = data.rfind(BEGIN_SYNC), data.rfind(END_SYNC)
+        if begin != end:
+            in_sync = begin > end
+        tail = data[-len(BEGIN_SYNC) + 1:]
+
+        if not in_sync:
+            repaints += 1
+            if received not in ends:
+                partial += 1
+
+    os.waitpid(pid, 0)
+    os.close(master)
+    os.close(slave)
+
+    return repaints, partial
+
+
+def main():
+    logging.disable(logging.INFO)
+
+    print('%-15s %8s %22s %22s' % ('', '', 'without sync', 'synchronized output'))
+    print('%-15s %8s %11s %10s %11s %10s' % ('workload', 'frames', 'repaints', 'partial',
+                                            'repaints', 'partial'))
+
+    for workload in get_workloads(DEFAULT_SIZE):
+        columns = [ workload.name ]
+
+        for synchronized_output in (False, True):
+            frames = render_frames(workload, synchronized_output)
+            repaints, partial = count_repaints(frames)
+
+            if not synchronized_output:
+                columns.append(len(frames))
+            columns.extend([repaints, partial])
+
+        print('%-15s %8i %11i %10i %11i %10i' % tuple(columns))
+
+
+if __name__ == '__main__':
+    main()
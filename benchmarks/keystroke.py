@@ -0,0 +1,116 @@
+"""
+Cost of repainting a session after the echo of a single keystroke.
+
+Eight panes of 250x70 are filled with text. Then one character is drawn in
+the first pane and the session is repainted. This is measured twice:
+    - all rows: every row of every pane is marked dirty before the repaint,
+      which means that all rows are compared, like before the screens kept
+      track of dirty rows.
+    - dirty rows: only the rows that were touched are compared.
+
+Run from the root of the repository:
+
+    python -m benchmarks.keystroke
+"""
+from libpymux.invalidate import Redraw
+from libpymux.layout import Location
+from libpymux.panes import Pane
+from libpymux.renderer import Renderer, RendererSize
+from libpymux.session import Session
+from libpymux.window import Window
+
+import logging
+import time
+import weakref
+
+PANES = 8
+COLUMNS = 250
+LINES = 70
+KEYSTROKES = 500
+
+
+class BenchmarkPane(Pane):
+    # Shown in the status bar.
+    process_id = None
+
+
+class NullRenderer(Renderer):
+    """ Renderer that only counts the bytes it receives. """
+    def __init__(self, session_ref, size):
+        super().__init__(session_ref)
+        self.size = size
+        self.bytes_written = 0
+
+    def get_size(self):
+        return self.size
+
+    def write_frame(self, data):
+        # Count the bytes right away, instead of queueing them. (There's no
+        # event loop running.)
+        self._last_size = self.get_size()
+        self.bytes_written += len(data)
+        return True
+
+
+def create_session():
+    """ Create a session with `PANES` panes, filled with text. """
+    session = Session()
+    window = Window()
+    session.add_window(window)
+
+    for i in range(PANES):
+        window.add_pane(BenchmarkPane(), vsplit=(i % 2 == 0))
+
+    for i, pane in enumerate(window.panes):
+        pane.set_location(Location(
+                (i % 4) * (COLUMNS + 1), (i // 4) * (LINES + 1), COLUMNS, LINES))
+        pane.write_output(''.join(
+                'pane %i, line %i %s\r\n' % (i, y, 'x' * (COLUMNS - 30)) for y in range(LINES)))
+
+    renderer = NullRenderer(weakref.ref(session),
+                            RendererSize(4 * (COLUMNS + 1), 2 * (LINES + 1) + 1))
+    session.renderers.append(renderer)
+
+    repaint(session, Redraw.ClearFirst | Redraw.Panes)
+    return session, window
+
+
+def repaint(session, parts):
+    session._invalidate_parts = parts
+    session.repaint()
+
+
+def measure(mark_all_dirty):
+    session, window = create_session()
+    panes = list(window.panes)
+    pane = panes[0]
+
+    start = time.perf_counter()
+
+    for i in range(KEYSTROKES):
+        # Echo a character and move the cursor back, like a shell would do.
+        pane.write_output('ab'[i % 2] + '\b')
+
+        if mark_all_dirty:
+            for p in panes:
+                p.screen._mark_dirty()
+
+        repaint(session, Redraw.Panes)
+
+    return (time.perf_counter() - start) / KEYSTROKES
+
+
+def main():
+    logging.disable(logging.INFO)
+
+    all_rows = measure(mark_all_dirty=True)
+    dirty_rows = measure(mark_all_dirty=False)
+
+    print('%i panes of %ix%i, %i keystrokes' % (PANES, COLUMNS, LINES, KEYSTROKES))
+    print('All rows:   %8.1f us per keystroke' % (all_rows * 1e6))
+    print('Dirty rows: %8.1f us per keystroke' % (dirty_rows * 1e6))
+    print('Speedup:    %8.1fx' % (all_rows / dirty_rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Cost of a repaint, for a growing amount of attached clients of the same size.
+
+A session with a few panes is repainted after every frame of output, like in
+`benchmarks.suite`, to 1 up to `MAX_OBSERVERS` renderers that only count the
+bytes. Renderers of the same size get the same frame, so the time per frame
+should hardly grow with the amount of renderers.
+
+Run from the root of the repository:
+
+    python -m benchmarks.observers
+"""
+from libpymux.invalidate import Redraw
+from libpymux.renderer import RendererSize
+
+from benchmarks.keystroke import NullRenderer, repaint
+from benchmarks.parser import build_log
+from benchmarks.suite import COLUMNS, LINES, FRAME_SIZE, create_session
+
+import logging
+import time
+import weakref
+
+PANES = 4
+FRAMES = 100
+MAX_OBSERVERS = 16
+
+
+def measure(observers, data):
+    """ Return the time per frame in ms, and the bytes written per renderer. """
+    session, window, renderer = create_session(PANES)
+
+    for i in range(observers - 1):
+        session.renderers.append(NullRenderer(weakref.ref(session), RendererSize(COLUMNS, LINES + 1)))
+
+    # The first frame paints the new renderers completely.
+    repaint(session, Redraw.Panes)
+    renderer.bytes_written = 0
+
+    panes = list(window.panes)
+    chunk = FRAME_SIZE // PANES
+    start = time.perf_counter()
+
+    for f in range(FRAMES):
+        for i, pane in enumerate(panes):
+            offset = (f * PANES + i) * chunk
+            pane.write_output(data[offset:offset + chunk])
+
+        repaint(session, session._invalidate_parts | Redraw.Panes)
+
+    return (time.perf_counter() - start) / FRAMES * 1e3, renderer.bytes_written / FRAMES
+
+
+def main():
+    logging.disable(logging.INFO)
+    data = build_log(FRAMES * FRAME_SIZE)
+
+    print('%-10s %10s %12s' % ('renderers', 'ms/frame', 'bytes/frame'))
+
+    observers = 1
+    while observers <= MAX_OBSERVERS:
+        ms, size = measure(observers, data)
+        print('%-10i %10.2f %12.0f' % (observers, ms, size))
+        observers *= 2
+
+
+if __name__ == '__main__':
+    main()
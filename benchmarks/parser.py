@@ -0,0 +1,217 @@
+"""
+Throughput of `BetterStream` compared to a plain `pyte.Stream`.
+
+Three workloads are generated, resembling recordings of:
+    - build log: mostly plain lines of text, some of them coloured.
+    - htop: full screen redraws, cursor positioning and many colour changes.
+    - vim scrolling: scroll regions, reverse index and syntax highlighting.
+
+Before measuring, the conformance corpus (a list of normal and unusual
+sequences) and the workloads are fed through both streams, and the events
+that the screen receives are compared. Also, every corpus entry is fed in two
+parts, split at every possible position.
+
+Run from the root of the repository:
+
+    python -m benchmarks.parser
+"""
+from libpymux.screen import BetterScreen
+from libpymux.stream import BetterStream
+
+import pyte
+import random
+import time
+
+LINES = 50
+COLUMNS = 160
+
+
+CONFORMANCE_CORPUS = [
+    'plain text\r\nnext line\n\ttab\x08\x08bs',
+    '\x07\x0e\x0f\x0b\x0c',
+    '\x1b[1;31mred\x1b[0m\x1b[m\x1b[;1m\x1b[38;5;100mX\x1b[48;2;1;2;3mY',
+    '\x1b[5;10H\x1b[H\x1b[2J\x1b[K\x1b[1K\x1b[3A\x1b[B\x1b[10C\x1b[D',
+    '\x1b[?1049h\x1b[?25l\x1b[?1049l\x1b[?25h\x1b[4h\x1b[4l',
+    '\x1b[3;20r\x1b[r\x1bM\x1bD\x1bE\x1b7\x1b8\x1bH\x1b[g\x1b[3g',
+    '\x1b(0lqk\x1b(B\x1b)0\x0eabc\x0f\x1b#8',
+    '\x1bc',
+    '\x9b5;5Hcsi8\x9bm',
+    '\x1b[99999;99999H\x1b[1;2;3;4H\x1b[1;2;3r after',
+    '\x1b[1;2;3Hswallowed\x1b[5;5Hok',
+    '\x1b[ 1m\x1b[1 ;2H\x1b[?1;?2h\x1b[1\n2H',
+    '\x1b[5\x07;5H\x1b[\x18text\x1b[1\x1aZ',
+    '\x1b]0;title\x07\x1bP\x1b\\\x1b%G\x1b*0',
+    '\x1b\x1b[m\x1b\n\x1b#3\x1b#Z\x1b[5x\x1b[5q',
+    '\x00\x7f\x01\x02\x1f\x1c drawn controls',
+    '\x1b[12@\x1b[2P\x1b[2L\x1b[2M\x1b[5G\x1b[5d\x1b[2E\x1b[2F\x1b[5`\x1b[2a\x1b[3e',
+    'wide 漢字 and é́ combining',
+    '\x1b[',
+    '\x1b',
+    '\x1b(',
+]
+
+
+def build_log(size):
+    r = random.Random(1)
+    words = ['gcc', '-O2', '-Wall', '-c', 'src/module.c', '-o', 'build/module.o',
+             '-Iinclude', '-DNDEBUG', 'warning:', 'unused', 'variable', "'x'"]
+    out = []
+    total = 0
+    i = 0
+
+    while total < size:
+        i += 1
+        if i % 10 == 0:
+            line = '\x1b[1m\x1b[31merror:\x1b[0m %s\r\n' % ' '.join(r.choice(words) for _ in range(8))
+        elif i % 4 == 0:
+            line = '\x1b[32m[%3i%%]\x1b[0m Building C object %s\r\n' % (i % 100, r.choice(words))
+        else:
+            line = ' '.join(r.choice(words) for _ in range(r.randint(4, 16))) + '\r\n'
+        out.append(line)
+        total += len(line)
+
+    return ''.join(out)
+
+
+def htop(size):
+    r = random.Random(2)
+    out = []
+    total = 0
+
+    while total < size:
+        frame = ['\x1b[H\x1b[?25l']
+        for y in range(1, LINES):
+            frame.append('\x1b[%i;1H' % y)
+            if y < 4:
+                frame.append('\x1b[1m\x1b[36m%2i\x1b[0m[\x1b[32m%s\x1b[31m%s\x1b[0m%s]' % (
+                    y, '|' * r.randint(0, 30), '|' * r.randint(0, 10), ' ' * 20))
+            else:
+                frame.append('\x1b[30m\x1b[46m' if y == 5 else '\x1b[0m')
+                frame.append('%6i \x1b[36mroot\x1b[39m   20   0 %7i %6i S %4.1f %4.1f  0:%05.2f %s' % (
+                    r.randint(1, 30000), r.randint(1000, 900000), r.randint(100, 90000),
+                    r.random() * 100, r.random() * 10, r.random() * 60, 'python3 -m pymux'))
+            frame.append('\x1b[K')
+        frame.append('\x1b[%i;1H\x1b[30;46mF1\x1b[0mHelp  \x1b[30;46mF10\x1b[0mQuit\x1b[?25h' % LINES)
+
+        frame = ''.join(frame)
+        out.append(frame)
+        total += len(frame)
+
+    return ''.join(out)
+
+
+def vim_scrolling(size):
+    r = random.Random(3)
+    keywords = ['\x1b[38;5;130mdef\x1b[m', '\x1b[38;5;130mreturn\x1b[m', '\x1b[1m\x1b[34mself\x1b[m',
+                '\x1b[35m"string"\x1b[m', 'value', 'index', '(', ')', ':', '\x1b[36m# comment\x1b[m']
+    out = []
+    total = 0
+    n = 0
+
+    while total < size:
+        n += 1
+        text = '    '.join(r.choice(keywords) for _ in range(r.randint(1, 8)))
+
+        if n % 3:
+            # Scroll down one line.
+            chunk = '\x1b[?25l\x1b[1;%ir\x1b[%i;1H\n\x1b[r\x1b[%i;1H%s\x1b[K' % (
+                LINES - 1, LINES - 1, LINES - 1, text)
+        else:
+            # Scroll up one line.
+            chunk = '\x1b[?25l\x1b[1;%ir\x1b[1;1H\x1bM\x1b[r\x1b[1;1H%s\x1b[K' % (LINES - 1, text)
+
+        chunk += '\x1b[%i;1H\x1b[7m"file.py" %i lines\x1b[27m\x1b[K\x1b[%i;5H\x1b[?25h' % (
+            LINES, n, r.randint(1, LINES - 1))
+
+        out.append(chunk)
+        total += len(chunk)
+
+    return ''.join(out)
+
+
+WORKLOADS = [
+    ('build log', build_log),
+    ('htop', htop),
+    ('vim scrolling', vim_scrolling),
+]
+
+
+class EventRecorder:
+    """ Listener that records all events. ``draw_text`` is split into ``draw`` events. """
+    def __init__(self):
+        self.events = []
+
+    def draw_text(self, text):
+        self.events.extend(('draw', (c, ), {}) for c in text)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def handler(*args, **kwargs):
+            self.events.append((name, args, kwargs))
+        return handler
+
+
+def screen_state(screen):
+    return ([ (l.text, list(l.styles)) for l in screen.history ],
+            [ (l.text, list(l.styles)) for l in screen._rows ],
+            screen.cursor.x, screen.cursor.y, screen.cursor.style, screen.cursor.hidden,
+            screen.margins, sorted(screen.mode), screen.charset)
+
+
+def run(stream_class, listener, parts):
+    stream = stream_class()
+    stream.attach(listener)
+    for data in parts:
+        stream.feed(data)
+    return stream
+
+
+def check(data, split_everywhere=False):
+    """ Raise `AssertionError` when both streams give other results for this data. """
+    splits = range(len(data) + 1) if split_everywhere else [len(data)]
+
+    for i in splits:
+        parts = [data[:i], data[i:]]
+
+        expected = run(pyte.Stream, EventRecorder(), parts).listeners[0][0].events
+        events = run(BetterStream, EventRecorder(), parts).listeners[0][0].events
+        assert events == expected, (data, i)
+
+        expected = screen_state(run(pyte.Stream, BetterScreen(LINES, COLUMNS), parts).listeners[0][0])
+        state = screen_state(run(BetterStream, BetterScreen(LINES, COLUMNS), parts).listeners[0][0])
+        assert state == expected, (data, i)
+
+
+def measure(stream_class, data, chunk_size=4096):
+    screen = BetterScreen(LINES, COLUMNS)
+    stream = stream_class()
+    stream.attach(screen)
+
+    start = time.perf_counter()
+    for i in range(0, len(data), chunk_size):
+        stream.feed(data[i:i + chunk_size])
+    return time.perf_counter() - start
+
+
+def main():
+    for data in CONFORMANCE_CORPUS:
+        check(data, split_everywhere=True)
+
+    print('Conformance corpus: %i entries OK' % len(CONFORMANCE_CORPUS))
+    print('%-15s %12s %12s %8s' % ('workload', 'pyte MB/s', 'pymux MB/s', 'speedup'))
+
+    for name, generate in WORKLOADS:
+        data = generate(1024 * 1024)
+        check(data[:100000])
+
+        mb = len(data) / 1e6
+        pyte_time = measure(pyte.Stream, data)
+        pymux_time = measure(BetterStream, data)
+
+        print('%-15s %12.2f %12.2f %7.1fx' % (name, mb / pyte_time, mb / pymux_time, pyte_time / pymux_time))
+
+
+if __name__ == '__main__':
+    main()
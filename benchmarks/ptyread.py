@@ -0,0 +1,117 @@
+"""
+Cost of reading the output of a pseudo terminal.
+
+A child process writes `DATA_SIZE` bytes to a pseudo terminal, as fast as
+possible. This is read and decoded, but not parsed:
+    - pipe transport: `loop.connect_read_pipe`, like panes did before, with
+      a protocol that decodes every chunk.
+    - `PtyReader`, with several values for the maximum amount of reads per
+      wakeup.
+
+For each, the throughput, and the amount of wakeups (calls of
+`write_output`) and reads per MB are reported.
+
+Run from the root of the repository:
+
+    python -m benchmarks.ptyread
+"""
+from libpymux.panes import PtyReader
+
+import asyncio
+import codecs
+import io
+import os
+import time
+import tty
+
+DATA_SIZE = 32 * 1024 * 1024
+
+loop = asyncio.get_event_loop()
+
+
+class Counter:
+    def __init__(self):
+        self.size = 0
+        self.calls = 0
+        self.done = asyncio.Future()
+
+    def write_output(self, text):
+        self.size += len(text)
+        self.calls += 1
+
+        if self.size >= DATA_SIZE:
+            self.done.set_result(None)
+
+
+class DecodingProtocol(asyncio.Protocol):
+    def __init__(self, write_output):
+        self._write_output = write_output
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def data_received(self, data):
+        self._write_output(self._decoder.decode(data))
+
+
+def start_writer(slave):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            data = b'x' * (64 * 1024)
+            for i in range(DATA_SIZE // len(data)):
+                os.write(slave, data)
+        finally:
+            os._exit(0)
+    return pid
+
+
+@asyncio.coroutine
+def measure(drain=None):
+    """ Use a pipe transport when `drain` is None, otherwise a `PtyReader`. """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    counter = Counter()
+    reads = None
+
+    if drain is None:
+        transport, protocol = yield from loop.connect_read_pipe(
+                lambda: DecodingProtocol(counter.write_output), io.open(master, 'rb', 0))
+    else:
+        reader = PtyReader(master, counter.write_output, drain=drain)
+        reader.start()
+
+    start = time.perf_counter()
+    pid = start_writer(slave)
+    yield from counter.done
+    duration = time.perf_counter() - start
+
+    if drain is None:
+        transport.close()
+    else:
+        reader.stop()
+        reads = reader.reads
+        os.close(master)
+
+    os.waitpid(pid, 0)
+    os.close(slave)
+
+    return duration, counter.calls, reads
+
+
+@asyncio.coroutine
+def run():
+    mb = DATA_SIZE / 1e6
+    print('%-18s %10s %12s %10s' % ('reader', 'MB/s', 'wakeups/MB', 'reads/MB'))
+
+    for drain in [None, 1, 4, 16]:
+        duration, wakeups, reads = yield from measure(drain)
+        print('%-18s %10.1f %12.1f %10s' % (
+            'pipe transport' if drain is None else 'PtyReader drain=%i' % drain,
+            mb / duration, wakeups / mb, '-' if reads is None else '%.1f' % (reads / mb)))
+
+
+def main():
+    loop.run_until_complete(run())
+
+
+if __name__ == '__main__':
+    main()
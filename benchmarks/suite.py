@@ -0,0 +1,312 @@
+"""
+Throughput and latency of the terminal pipeline, for several workloads.
+
+Every workload is a byte stream, like a recording of what an application
+writes to its pseudo terminal. It is replayed without running any process:
+    - parse: the bytes are decoded and fed in chunks of `READ_SIZE` through
+      a `BetterStream` into a `BetterScreen`.
+    - repaint: the bytes are fed to the panes of a `Session` in frames of
+      `FRAME_SIZE`, and after every frame the session is repainted, through
+      `Session.repaint` and `Renderer._repaint`, to a renderer that only
+      counts the bytes.
+    - memory: the repaint run again, while tracing the peak memory usage.
+
+The results are printed, and can be written as JSON, to compare them with a
+later run:
+
+    python -m benchmarks.suite --output before.json
+    (make changes)
+    python -m benchmarks.suite --compare before.json
+
+Recordings (for instance made with ``script``) can be added as workloads
+with ``--recording FILE``.
+"""
+from libpymux.invalidate import Redraw
+from libpymux.layout import Location
+from libpymux.renderer import RendererSize
+from libpymux.screen import BetterScreen
+from libpymux.session import Session
+from libpymux.stream import BetterStream
+from libpymux.window import Window
+
+from benchmarks.keystroke import BenchmarkPane, NullRenderer, repaint
+from benchmarks.parser import build_log, htop, vim_scrolling
+
+from collections import OrderedDict
+import argparse
+import codecs
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import time
+import tracemalloc
+import weakref
+
+LINES = 50
+COLUMNS = 160
+
+#: Size of the chunks that are fed to the stream. (Like reads of a pty.)
+READ_SIZE = 4096
+
+#: Amount of bytes that a pane receives between two repaints.
+FRAME_SIZE = 16 * 1024
+
+#: Default size of a generated workload.
+DEFAULT_SIZE = 1024 * 1024
+
+
+def plain_text(size):
+    r = random.Random(4)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit']
+    out = []
+    total = 0
+
+    while total < size:
+        line = ' '.join(r.choice(words) for _ in range(r.randint(1, 25))) + '\r\n'
+        out.append(line)
+        total += len(line)
+
+    return ''.join(out)
+
+
+def colours_256(size):
+    r = random.Random(5)
+    out = []
+    total = 0
+
+    while total < size:
+        line = ' '.join('\x1b[38;5;%im\x1b[48;5;%imword%i\x1b[0m' % (
+                        r.randint(0, 255), r.randint(0, 255), i) for i in range(r.randint(1, 12)))
+        line += '\r\n'
+        out.append(line)
+        total += len(line)
+
+    return ''.join(out)
+
+
+def box_drawing(size):
+    """ Dialogs with a coloured background and a border, like ncurses applications. """
+    r = random.Random(6)
+    out = []
+    total = 0
+
+    while total < size:
+        top = r.randint(1, LINES // 2)
+        left = r.randint(1, COLUMNS // 2)
+        height = r.randint(3, LINES - top)
+        width = r.randint(10, COLUMNS - left)
+
+        frame = ['\x1b[0;44m\x1b[2J\x1b[1;37;46m\x1b[%i;%iH┌%s┐' % (top, left, '─' * (width - 2))]
+        for y in range(top + 1, top + height - 1):
+            frame.append('\x1b[%i;%iH│%s│' % (y, left, ' ' * (width - 2)))
+        frame.append('\x1b[%i;%iH└%s┘' % (top + height - 1, left, '─' * (width - 2)))
+        frame.append('\x1b[%i;%iH\x1b[30;47m< OK >\x1b[0m' % (top + height - 2, left + width // 2 - 3))
+
+        frame = ''.join(frame)
+        out.append(frame)
+        total += len(frame)
+
+    return ''.join(out)
+
+
+class Workload:
+    """
+    :param data: The bytes that are written to the panes.
+    :param panes: Amount of panes. Every pane receives its own part of the
+        data, and `FRAME_SIZE` is divided over them.
+    """
+    def __init__(self, name, data, panes=1):
+        self.name = name
+        self.data = data
+        self.panes = panes
+
+    def get_frames(self, pane_index):
+        """ The chunks that this pane receives in every frame. """
+        part = len(self.data) // self.panes
+        data = self.data[pane_index * part:(pane_index + 1) * part]
+        frame_size = FRAME_SIZE // self.panes
+
+        return [ data[i:i + frame_size] for i in range(0, len(data), frame_size) ]
+
+
+def get_workloads(size):
+    def generated(function):
+        return function(size).encode('utf-8')
+
+    return [
+        Workload('plain text', generated(plain_text)),
+        Workload('256 colours', generated(colours_256)),
+        Workload('vim scrolling', generated(vim_scrolling)),
+        Workload('htop', generated(htop)),
+        Workload('box drawing', generated(box_drawing)),
+        Workload('many panes', generated(build_log), panes=16),
+    ]
+
+
+def measure_parse(workload):
+    """ Return the throughput of decoding and parsing, in MB/s. """
+    screen = BetterScreen(LINES, COLUMNS)
+    stream = BetterStream()
+    stream.attach(screen)
+    decode = codecs.getincrementaldecoder('utf-8')(errors='replace').decode
+    data = workload.data
+
+    start = time.perf_counter()
+    for i in range(0, len(data), READ_SIZE):
+        stream.feed(decode(data[i:i + READ_SIZE]))
+
+    return len(data) / 1e6 / (time.perf_counter() - start)
+
+
+def create_session(pane_count):
+    """
+    Session with a window of `COLUMNS` x `LINES` with this amount of panes.
+    The largest pane is split every time, which gives a grid.
+    """
+    session = Session()
+    window = Window()
+    session.add_window(window)
+    window.layout.set_location(Location(0, 0, COLUMNS, LINES))
+    window.add_pane(BenchmarkPane())
+
+    for i in range(pane_count - 1):
+        pane = max(window.panes, key=lambda p: p.sx * p.sy)
+        window.active_pane = pane
+        window.add_pane(BenchmarkPane(), vsplit=(pane.sx > 3 * pane.sy))
+
+    renderer = NullRenderer(weakref.ref(session), RendererSize(COLUMNS, LINES + 1))
+    session.renderers.append(renderer)
+    repaint(session, Redraw.All)
+    renderer.bytes_written = 0
+
+    return session, window, renderer
+
+
+def run_repaint(workload):
+    """
+    Feed the frames to the panes and repaint after every frame. Return the
+    amount of frames, the time spent in repaints, and the bytes rendered.
+    """
+    session, window, renderer = create_session(workload.panes)
+    panes = list(window.panes)
+    frames = [ workload.get_frames(i) for i in range(len(panes)) ]
+    decoders = [ codecs.getincrementaldecoder('utf-8')(errors='replace') for _ in panes ]
+    repaint_time = 0
+
+    for f in range(len(frames[0])):
+        for pane, pane_frames, decoder in zip(panes, frames, decoders):
+            pane.write_output(decoder.decode(pane_frames[f]))
+
+        start = time.perf_counter()
+        repaint(session, session._invalidate_parts | Redraw.Panes)
+        repaint_time += time.perf_counter() - start
+
+    return len(frames[0]), repaint_time, renderer.bytes_written
+
+
+def measure_memory(workload):
+    """ Peak amount of traced memory during the repaint run. """
+    tracemalloc.start()
+    try:
+        run_repaint(workload)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_workload(workload):
+    frames, repaint_time, bytes_written = run_repaint(workload)
+
+    return {
+        'size': len(workload.data),
+        'panes': workload.panes,
+        'parse_mb_per_s': measure_parse(workload),
+        'frames': frames,
+        'repaint_ms_per_frame': repaint_time / frames * 1e3,
+        'bytes_per_frame': bytes_written / frames,
+        'peak_memory_bytes': measure_memory(workload),
+    }
+
+
+METRICS = [
+    # (key, column title, format, scale, higher is better)
+    ('parse_mb_per_s', 'parse MB/s', '%.2f', 1, True),
+    ('repaint_ms_per_frame', 'ms/frame', '%.2f', 1, False),
+    ('bytes_per_frame', 'bytes/frame', '%.0f', 1, False),
+    ('peak_memory_bytes', 'peak MB', '%.1f', 1e-6, False),
+]
+
+
+def print_results(results, previous=None):
+    print('%-15s' % 'workload' + ''.join('%22s' % title for _, title, _, _, _ in METRICS))
+
+    for name, result in results.items():
+        columns = []
+        old_result = previous.get(name) if previous else None
+
+        for key, title, fmt, scale, higher_is_better in METRICS:
+            text = fmt % (result[key] * scale)
+
+            if old_result and old_result.get(key) and result[key]:
+                if higher_is_better:
+                    ratio = result[key] / old_result[key]
+                else:
+                    ratio = old_result[key] / result[key]
+                text += ' (%5.2fx)' % ratio
+
+            columns.append('%22s' % text)
+
+        print('%-15s' % name + ''.join(columns))
+
+    if previous:
+        print('(Compared to the previous run. Above 1.00x is an improvement.)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the terminal pipeline.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--compare', help='JSON file of a previous run.')
+    parser.add_argument('--size', type=float, default=DEFAULT_SIZE / 1024 / 1024,
+                        help='Size of the generated workloads in MB.')
+    parser.add_argument('--recording', action='append', default=[],
+                        help='File with a recorded byte stream, to add as a workload.')
+    parser.add_argument('--only', action='append', default=[],
+                        help='Run only the workload with this name.')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    workloads = get_workloads(int(args.size * 1024 * 1024))
+    for filename in args.recording:
+        with open(filename, 'rb') as f:
+            workloads.append(Workload(os.path.basename(filename), f.read()))
+
+    if args.only:
+        workloads = [ w for w in workloads if w.name in args.only ]
+
+    results = OrderedDict((w.name, run_workload(w)) for w in workloads)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['workloads']
+
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'lines': LINES,
+                'columns': COLUMNS,
+                'workloads': results,
+            }, f, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Throughput of output-heavy panes, parsed in the main process compared to
+parsing in a `WorkerPool`.
+
+Every pane gets a child process that writes a build log of `DATA_SIZE` bytes
+to its pseudo terminal, as fast as possible. The time is measured until the
+(mirror) screens of all panes show the last line. This is done once with the
+output parsed on the event loop, and once for every amount of worker
+processes up to the amount of CPUs.
+
+Ideally, the throughput grows linearly with the amount of workers, until
+there are as many workers as CPUs. (On a single CPU machine, the workers can
+only add overhead.)
+
+Run from the root of the repository:
+
+    python -m benchmarks.workers
+"""
+from libpymux.layout import Location
+from libpymux.panes import Pane, PtyReader
+from libpymux.workers import WorkerPool
+
+from benchmarks.parser import build_log
+
+import asyncio
+import os
+import time
+import tty
+
+LINES = 50
+COLUMNS = 160
+DATA_SIZE = 1024 * 1024
+
+
+class BenchmarkPane(Pane):
+    def invalidate(self):
+        pass
+
+    def is_done(self):
+        return self.screen.get_line(self.screen.line_offset).text.startswith('DONE')
+
+
+def start_writer(pane, data):
+    """ Fork a process that writes `data` to the pseudo terminal of this pane. """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.write(pane.slave, data)
+        finally:
+            os._exit(0)
+    return pid
+
+
+@asyncio.coroutine
+def measure(pane_count, worker_count):
+    """
+    Return the time it takes to parse the output of `pane_count` panes.
+    When `worker_count` is 0, parse in this process.
+    """
+    pool = WorkerPool(worker_count) if worker_count else None
+    data = (build_log(DATA_SIZE) + '\x1b[2J\x1b[HDONE').encode('utf-8')
+    panes = []
+    readers = []
+
+    for i in range(pane_count):
+        pane = BenchmarkPane(worker_pool=pool)
+        pane.set_location(Location(0, 0, COLUMNS, LINES))
+        tty.setraw(pane.slave)
+        panes.append(pane)
+
+        if pool:
+            pool.add_pane(pane)
+        else:
+            reader = PtyReader(pane.master, pane.write_output)
+            reader.start()
+            readers.append(reader)
+
+    start = time.perf_counter()
+    pids = [ start_writer(pane, data) for pane in panes ]
+
+    while not all(pane.is_done() for pane in panes):
+        yield from asyncio.sleep(.005)
+
+    result = time.perf_counter() - start
+
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    if pool:
+        pool.stop()
+
+    for reader in readers:
+        reader.stop()
+
+    for pane in panes:
+        os.close(pane.master)
+        os.close(pane.slave)
+
+    return result
+
+
+@asyncio.coroutine
+def run():
+    cpus = os.cpu_count() or 1
+    pane_count = max(4, 2 * cpus)
+    mb = pane_count * DATA_SIZE / 1e6
+
+    print('%i panes, %i CPUs' % (pane_count, cpus))
+    print('%-15s %10s %8s' % ('parsing', 'MB/s', 'speedup'))
+
+    base = yield from measure(pane_count, 0)
+    print('%-15s %10.2f %7.1fx' % ('main process', mb / base, 1))
+
+    for workers in sorted(set([1, 2, cpus // 2, cpus]) - set([0])):
+        duration = yield from measure(pane_count, workers)
+        print('%-15s %10.2f %7.1fx' % ('%i workers' % workers, mb / duration, base / duration))
+
+
+def main():
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,19 @@
 #!/usr/bin/env python
 
 """Usage:
-  pymux.py run
-  pymux.py server
-  pymux.py attach
+  pymux.py run [--synchronized-output] [--repeat]
+  pymux.py server [--workers=<n>]
+  pymux.py attach [--synchronized-output] [--repeat]
   pymux.py session-info
   pymux.py new-window
+
+Options:
+  --synchronized-output  The terminal supports synchronized updates (DEC mode
+                         2026), like kitty, WezTerm, foot and iTerm2 do.
+  --repeat               The terminal supports REP (repeat the preceding
+                         character), like xterm, VTE and tmux do.
+  --workers=<n>          Parse the output of the panes in this amount of
+                         worker processes. [default: 0]
 """
 
 import sys
@@ -26,13 +34,15 @@ def start(name=sys.argv[0]):
     a = docopt.docopt(__doc__.replace('pymux.py', name))#, version=__version__)
 
     if a['run']:
-        start_standalone()
+        start_standalone(synchronized_output=a['--synchronized-output'],
+                         repeat=a['--repeat'])
 
     elif a['server']:
-        start_server()
+        start_server(worker_processes=int(a['--workers']))
 
     elif a['attach']:
-        start_client()
+        start_client(synchronized_output=a['--synchronized-output'],
+                     repeat=a['--repeat'])
 
     elif a['session-info']:
         pp = pprint.PrettyPrinter(indent=4)
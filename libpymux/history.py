@@ -0,0 +1,419 @@
+"""
+Scrollback history of a screen.
+
+The most recent lines are kept as `Line` objects. Older lines are packed in
+compressed blocks, which are unpacked again when they are accessed. These
+blocks can optionally be moved out of memory, into a temporary file that is
+memory mapped for reading.
+
+A compressed block gets a trigram bitmap of its text the first time that it's
+searched. Later searches only have to unpack the blocks that can contain a
+match. (See `libpymux.search`.)
+"""
+from array import array
+from collections import deque
+import mmap
+import sys
+import tempfile
+import zlib
+
+from .line import Line, _UCS4
+from .search import trigram_bitmap
+
+__all__ = ('History', 'DEFAULT_HISTORY_LIMIT', 'DEFAULT_COLD_THRESHOLD')
+
+
+#: Default amount of lines that are kept in the scrollback. (Like the
+#: `history-limit` option of tmux.)
+DEFAULT_HISTORY_LIMIT = 2000
+
+#: Default amount of recent lines that are kept uncompressed.
+DEFAULT_COLD_THRESHOLD = 1000
+
+#: Amount of lines in a compressed block.
+BLOCK_SIZE = 256
+
+#: Compact the spill file when more than half of it belongs to dropped blocks,
+#: and it's at least this size.
+_MIN_SPILL_GARBAGE = 1024 * 1024
+
+_ITEMSIZE = array('I').itemsize
+
+
+def _encode_block(lines):
+    """
+    Pack lines in a compressed string: the length of every line, the text
+    as UTF-8, followed by the style IDs. (zlib takes care of the runs of
+    equal style IDs.)
+    """
+    lengths = array('I', [ len(l.chars) for l in lines ])
+    text = b''.join(l.chars.tobytes() for l in lines).decode(_UCS4) \
+                .encode('utf-8', 'surrogatepass')
+    styles = b''.join(l.styles.tobytes() for l in lines)
+    header = array('I', [len(lines), len(text)])
+
+    return zlib.compress(header.tobytes() + lengths.tobytes() + text + styles, 1)
+
+
+def _decode_block(data):
+    """ Inverse of `_encode_block`. Returns a list of `Line` objects. """
+    data = zlib.decompress(data)
+
+    header = array('I')
+    header.frombytes(data[:2 * _ITEMSIZE])
+    count, text_size = header
+    pos = 2 * _ITEMSIZE
+
+    lengths = array('I')
+    lengths.frombytes(data[pos:pos + count * _ITEMSIZE])
+    pos += count * _ITEMSIZE
+
+    chars = array('I', data[pos:pos + text_size].decode('utf-8', 'surrogatepass').encode(_UCS4))
+    pos += text_size
+
+    styles = array('I')
+    styles.frombytes(data[pos:])
+
+    result = []
+    offset = 0
+    for length in lengths:
+        result.append(Line(chars[offset:offset + length], styles[offset:offset + length]))
+        offset += length
+    return result
+
+
+class _ColdBlock:
+    """
+    `BLOCK_SIZE` compressed lines. `data` is `None` when the block has been
+    moved to the spill file, then `offset` and `size` tell where to find it.
+    `trigrams` is the search bitmap, created when the block is first searched.
+    """
+    __slots__ = ('data', 'offset', 'size', 'trigrams')
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = None
+        self.size = len(data)
+        self.trigrams = None
+
+
+class _SpillFile:
+    """
+    Temporary file to which compressed blocks are appended. Reading happens
+    through a memory map, so the data is in the page cache instead of being
+    part of the process memory.
+    """
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._mmap = None
+        self.size = 0
+
+        # Amount of bytes that belong to blocks that are no longer used.
+        self.garbage = 0
+
+    def write(self, data):
+        """ Append data, return the offset. """
+        offset = self.size
+        self._file.seek(offset)
+        self._file.write(data)
+        self.size += len(data)
+        return offset
+
+    def read(self, offset, size):
+        if self._mmap is None or len(self._mmap) < offset + size:
+            self._file.flush()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ)
+
+        return self._mmap[offset:offset + size]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+class History:
+    """
+    Ring buffer containing the lines that were scrolled off the top of the
+    screen. The oldest line is index 0. When the history is full, appending a
+    line drops the oldest one in O(1).
+
+    Lines that are older than the `cold_threshold` most recent ones are
+    compressed per `BLOCK_SIZE` lines. Accessing them returns a decompressed
+    copy; changing that copy doesn't change the history.
+
+    :param limit: Maximum amount of lines to keep.
+    :param cold_threshold: Amount of recent lines that stay uncompressed.
+    :param spill: Move the compressed blocks to a temporary file.
+    """
+    def __init__(self, limit=DEFAULT_HISTORY_LIMIT, cold_threshold=DEFAULT_COLD_THRESHOLD,
+                 spill=False):
+        self._limit = limit
+        self.cold_threshold = cold_threshold
+        self.spill = spill
+
+        self._hot = deque()
+        self._blocks = deque()
+        self._spill_file = None
+
+        # Amount of lines in the blocks, and the amount of lines at the start
+        # of the first block that were dropped already.
+        self._cold_count = 0
+        self._skip = 0
+
+        #: Amount of lines that were dropped at the top. Used to keep track of
+        #: a position while the indexes shift.
+        self.dropped = 0
+
+        #: Amount of lines that were appended and removed at the bottom, and a
+        #: counter that's increased every time that the history is cleared.
+        #: Used to send only the changes to a copy of this history. (See
+        #: `libpymux.workers`.)
+        self.appended = 0
+        self.popped = 0
+        self.generation = 0
+
+        #: Lowest value of `appended - popped` since the copy reset it. The
+        #: lines above that position didn't change.
+        self.low_water = 0
+
+        # The most recently decompressed block.
+        self._cached_block = None
+        self._cached_lines = None
+
+    def __len__(self):
+        return self._cold_count + len(self._hot)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError('History index out of range')
+
+        if index < self._cold_count:
+            index += self._skip
+            return self._get_block_lines(self._blocks[index // BLOCK_SIZE])[index % BLOCK_SIZE]
+        else:
+            return self._hot[index - self._cold_count]
+
+    def __iter__(self):
+        skip = self._skip
+
+        for block in list(self._blocks):
+            for line in self._get_block_lines(block)[skip:]:
+                yield line
+            skip = 0
+
+        for line in list(self._hot):
+            yield line
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @limit.setter
+    def limit(self, value):
+        # Keep the most recent lines.
+        self._limit = value
+        self.trim(value)
+
+    def append(self, line):
+        """ Add a line at the bottom. """
+        if self._limit == 0:
+            return
+
+        self._hot.append(line)
+        self.appended += 1
+
+        if len(self) > self._limit:
+            self._drop_oldest()
+
+        if len(self._hot) >= self.cold_threshold + BLOCK_SIZE:
+            self._freeze()
+
+    def pop(self):
+        """ Remove and return the most recent line. """
+        if not self._hot and self._blocks:
+            self._thaw()
+
+        line = self._hot.pop()
+        self.popped += 1
+        self.low_water = min(self.low_water, self.appended - self.popped)
+        return line
+
+    def trim(self, length):
+        """ Drop the oldest lines, until at most `length` lines are left. """
+        while len(self) > length:
+            self._drop_oldest()
+
+    def clear(self):
+        self.dropped += len(self)
+        self.generation += 1
+        self._hot.clear()
+        self._blocks.clear()
+        self._cold_count = 0
+        self._skip = 0
+        self._cached_block = self._cached_lines = None
+
+        if self._spill_file:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def get_state(self):
+        """
+        For snapshots. Return a (skip, blocks, lines) tuple: the compressed
+        data of every block, the amount of dropped lines at the start of the
+        first block, and copies of the uncompressed lines.
+        """
+        blocks = [ b.data if b.data is not None else self._spill_file.read(b.offset, b.size)
+                   for b in self._blocks ]
+        return self._skip, blocks, [ l.copy() for l in self._hot ]
+
+    def set_state(self, skip, blocks, lines):
+        """ Inverse of `get_state`. (The limit is applied afterwards.) """
+        self.clear()
+
+        for data in blocks:
+            self._add_block(_ColdBlock(data))
+
+        self._skip = skip
+        self._cold_count -= skip
+        self._hot.extend(lines)
+        self.trim(self._limit)
+
+        while len(self._hot) >= self.cold_threshold + BLOCK_SIZE:
+            self._freeze()
+
+    def memory_usage(self):
+        """
+        Return a dict with the amount of lines, and the (approximate) amount
+        of bytes used by the uncompressed and compressed lines, and the bytes
+        that were moved to the spill file.
+        """
+        hot_bytes = sum(sys.getsizeof(l) + sys.getsizeof(l.chars) + sys.getsizeof(l.styles)
+                        for l in self._hot)
+        compressed_bytes = sum(len(b.data) for b in self._blocks if b.data is not None)
+        compressed_bytes += sum(len(b.trigrams) for b in self._blocks if b.trigrams)
+        spilled_bytes = sum(b.size for b in self._blocks if b.data is None)
+
+        return {
+            'lines': len(self),
+            'hot_bytes': hot_bytes,
+            'compressed_bytes': compressed_bytes,
+            'spilled_bytes': spilled_bytes,
+        }
+
+    def search(self, query, index, backwards=False):
+        """
+        Find the first line, starting at `index`, that matches this
+        `SearchQuery`. When `backwards` is set, go towards the oldest line and
+        take the last match in a line. Returns an (index, (start, end)) tuple,
+        or None.
+        """
+        while 0 <= index < len(self):
+            if index < self._cold_count:
+                # Compressed block. Skip it if the bitmap excludes a match.
+                pos = index + self._skip
+                block = self._blocks[pos // BLOCK_SIZE]
+                first = max(0, index - pos % BLOCK_SIZE)
+                last = min(self._cold_count, index - pos % BLOCK_SIZE + BLOCK_SIZE)
+
+                if block.trigrams is None:
+                    block.trigrams = trigram_bitmap([ l.text for l in self._get_block_lines(block) ])
+
+                if query.may_match(block.trigrams):
+                    lines = self._get_block_lines(block)
+                    offset = self._skip - pos // BLOCK_SIZE * BLOCK_SIZE
+
+                    for i in (range(index, first - 1, -1) if backwards else range(index, last)):
+                        span = query.search_line(lines[i + offset].text, backwards=backwards)
+                        if span:
+                            return i, span
+
+                index = first - 1 if backwards else last
+            else:
+                span = query.search_line(self._hot[index - self._cold_count].text,
+                                         backwards=backwards)
+                if span:
+                    return index, span
+
+                index += -1 if backwards else 1
+
+    def _drop_oldest(self):
+        self.dropped += 1
+
+        if self._blocks:
+            self._skip += 1
+            self._cold_count -= 1
+
+            if self._skip == BLOCK_SIZE:
+                self._remove_block(self._blocks.popleft())
+                self._skip = 0
+        else:
+            self._hot.popleft()
+
+    def _freeze(self):
+        """ Compress the oldest `BLOCK_SIZE` uncompressed lines. """
+        lines = [ self._hot.popleft() for _ in range(BLOCK_SIZE) ]
+        self._add_block(_ColdBlock(_encode_block(lines)))
+
+    def _add_block(self, block):
+        if self.spill:
+            if self._spill_file is None:
+                self._spill_file = _SpillFile()
+
+            block.offset = self._spill_file.write(block.data)
+            block.data = None
+
+        self._blocks.append(block)
+        self._cold_count += BLOCK_SIZE
+
+    def _thaw(self):
+        """ Decompress the most recent block into the uncompressed lines. """
+        block = self._blocks.pop()
+        lines = self._get_block_lines(block)
+
+        if not self._blocks:
+            lines = lines[self._skip:]
+            self._skip = 0
+
+        self._hot.extendleft(reversed(lines))
+        self._cold_count -= len(lines)
+        self._remove_block(block)
+
+    def _get_block_lines(self, block):
+        if block is not self._cached_block:
+            if block.data is None:
+                data = self._spill_file.read(block.offset, block.size)
+            else:
+                data = block.data
+
+            self._cached_lines = _decode_block(data)
+            self._cached_block = block
+
+        return self._cached_lines
+
+    def _remove_block(self, block):
+        if block is self._cached_block:
+            self._cached_block = self._cached_lines = None
+
+        if block.data is None:
+            self._spill_file.garbage += block.size
+            self._compact_spill_file()
+
+    def _compact_spill_file(self):
+        """ Rewrite the spill file when it contains mostly dropped blocks. """
+        old = self._spill_file
+
+        if old.garbage > _MIN_SPILL_GARBAGE and old.garbage > old.size // 2:
+            new = _SpillFile()
+
+            for block in self._blocks:
+                if block.data is None:
+                    block.offset = new.write(old.read(block.offset, block.size))
+
+            old.close()
+            self._spill_file = new
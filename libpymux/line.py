@@ -0,0 +1,104 @@
+"""
+Storage of a single row of a screen.
+"""
+from array import array
+import sys
+
+__all__ = ('Line', 'SPACE')
+
+
+#: Codec that encodes a string as native 32 bit code points. (The memory layout
+#: of an `array('I')`.)
+_UCS4 = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+SPACE = ord(' ')
+
+_BLANK_CHARS = array('I', [SPACE])
+_BLANK_STYLES = array('I', [0])
+
+
+class Line:
+    """
+    One row of the screen.
+
+    Characters are stored as code points in `chars`, the parallel `styles`
+    array contains the style ID of every cell. (See `libpymux.styles`.) The
+    row grows when a character is written behind the end; all cells behind
+    the end are blank.
+    """
+    __slots__ = ('chars', 'styles')
+
+    def __init__(self, chars=None, styles=None):
+        self.chars = array('I') if chars is None else chars
+        self.styles = array('I') if styles is None else styles
+
+    def __len__(self):
+        return len(self.chars)
+
+    def __repr__(self):
+        return 'Line(%r)' % self.text
+
+    @property
+    def text(self):
+        return self.chars.tobytes().decode(_UCS4)
+
+    def copy(self, length=None):
+        """ Copy of this row. (Truncated to `length` cells if given.) """
+        return Line(self.chars[:length], self.styles[:length])
+
+    def get(self, x):
+        """ Return a (code_point, style_id) tuple for this cell. """
+        if x < len(self.chars):
+            return self.chars[x], self.styles[x]
+        else:
+            return SPACE, 0
+
+    def set(self, x, code_point, style_id):
+        if x >= len(self.chars):
+            self._pad(x + 1)
+
+        self.chars[x] = code_point
+        self.styles[x] = style_id
+
+    def write(self, x, text, style_id):
+        """ Write a string, starting at position `x`, all in the same style. """
+        end = x + len(text)
+        if end > len(self.chars):
+            self._pad(end)
+
+        self.chars[x:end] = array('I', text.encode(_UCS4))
+        self.styles[x:end] = array('I', [style_id]) * len(text)
+
+    def _pad(self, length):
+        """ Append blank cells until this row contains `length` cells. """
+        missing = length - len(self.chars)
+        if missing > 0:
+            self.chars.extend(_BLANK_CHARS * missing)
+            self.styles.extend(_BLANK_STYLES * missing)
+
+    def erase(self, start=0, end=None):
+        """ Make the cells from `start` to `end` (exclusive) blank. """
+        if end is None or end >= len(self.chars):
+            del self.chars[start:]
+            del self.styles[start:]
+        elif start < end:
+            self.chars[start:end] = _BLANK_CHARS * (end - start)
+            self.styles[start:end] = _BLANK_STYLES * (end - start)
+
+    def insert(self, x, count, width=None):
+        """
+        Insert `count` blank cells at position `x`, shifting the remainder of
+        the row to the right. Cells pushed beyond `width` are lost.
+        """
+        if x < len(self.chars):
+            self.chars[x:x] = _BLANK_CHARS * count
+            self.styles[x:x] = _BLANK_STYLES * count
+
+            if width is not None:
+                del self.chars[width:]
+                del self.styles[width:]
+
+    def delete(self, x, count):
+        """ Remove `count` cells at position `x`, shifting the remainder to the left. """
+        del self.chars[x:x + count]
+        del self.styles[x:x + count]
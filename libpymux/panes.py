@@ -1,16 +1,20 @@
 
 import asyncio
+import codecs
+import fcntl
 import resource
-import pyte
 import os
-import io
 import signal
 
 from .log import logger
 from .utils import set_size
 from .pexpect_utils import pty_make_controlling_tty
+from .history import DEFAULT_HISTORY_LIMIT, DEFAULT_COLD_THRESHOLD
 from .layout import Container, Location
 from .screen import BetterScreen
+from .search import SearchQuery
+from .stream import BetterStream
+from .workers import MirrorScreen
 from .invalidate import Redraw
 
 loop = asyncio.get_event_loop()
@@ -62,24 +66,128 @@ class BorderType:
     TopLeft = Position.Right | Position.Bottom
 
 
-class SubProcessProtocol(asyncio.protocols.SubprocessProtocol):
-    def __init__(self, write_output):
-        self.transport = None
+#: Maps the position of a cell relative to a pane to a border type.
+_BORDER_TYPES = {
+    CellPosition.TopBorder: BorderType.Horizontal,
+    CellPosition.BottomBorder: BorderType.Horizontal,
+    CellPosition.LeftBorder: BorderType.Vertical,
+    CellPosition.RightBorder: BorderType.Vertical,
+
+    CellPosition.TopLeftBorder: BorderType.TopLeft,
+    CellPosition.TopRightBorder: BorderType.TopRight,
+    CellPosition.BottomLeftBorder: BorderType.BottomLeft,
+    CellPosition.BottomRightBorder: BorderType.BottomRight,
+
+    CellPosition.Inside: BorderType.Inside,
+    CellPosition.Outside: BorderType.Outside,
+}
+
+
+#: Bounds of the amount of bytes that are read from a pseudo terminal at once.
+MIN_READ_SIZE = 1024
+MAX_READ_SIZE = 256 * 1024
+
+#: Default maximum amount of reads from a pseudo terminal per wakeup.
+DEFAULT_READ_DRAIN = 4
+
+
+class PtyReader:
+    """
+    Reads the output of a pseudo terminal with `loop.add_reader`, into a
+    preallocated buffer, and passes it decoded to `write_output`.
+
+    The read size adapts to the pane: it doubles when a read fills it (the
+    application floods output), and it halves when a read returns less than
+    a quarter of it (interactive use).
+
+    A multibyte character can be split over two reads, so the decoder is
+    incremental. Invalid bytes become U+FFFD instead of raising an error.
+
+    :param drain: Maximum amount of reads per wakeup. The output of these
+        reads is passed to `write_output` at once, so during a flood the pane
+        is invalidated only once for several reads.
+    """
+    def __init__(self, fd, write_output, drain=DEFAULT_READ_DRAIN):
+        self.fd = fd
+        self.drain = drain
+        self.read_size = MIN_READ_SIZE
+
         self._write_output = write_output
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._buffer = memoryview(bytearray(MAX_READ_SIZE))
+        self._reading = False
 
-    def connection_made(self, transport):
-        self.transport = transport
+        # Statistics.
+        self.bytes_read = 0
+        self.reads = 0
+        self.wakeups = 0
 
-    def data_received(self, data):
-        self._write_output(data.decode('utf-8'))
+    def start(self):
+        flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 
+        loop.add_reader(self.fd, self._read_ready)
+        self._reading = True
 
+    def stop(self):
+        if self._reading:
+            loop.remove_reader(self.fd)
+            self._reading = False
+
+    def _read_ready(self):
+        self.wakeups += 1
+        decode = self._decoder.decode
+        chunks = []
+
+        for i in range(self.drain):
+            read_size = self.read_size
+            try:
+                size = os.readv(self.fd, [self._buffer[:read_size]])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # EIO: the other side of the pseudo terminal was closed.
+                size = 0
+
+            if size == 0:
+                self.stop()
+                chunks.append(decode(b'', final=True))
+                break
+
+            self.reads += 1
+            self.bytes_read += size
+            chunks.append(decode(self._buffer[:size]))
+
+            if size == read_size:
+                self.read_size = min(read_size * 2, MAX_READ_SIZE)
+
+            elif size < read_size // 4:
+                self.read_size = max(read_size // 2, MIN_READ_SIZE)
+
+                # Interactive output, don't wait for more.
+                break
+
+        text = ''.join(chunks)
+
+        # Nothing to draw when we only received the start of a character.
+        if text:
+            self._write_output(text)
 
 
 class Pane(Container):
+    """
+    :param history_limit: Maximum amount of lines to keep in the scrollback.
+    :param history_cold_threshold: Amount of recent scrollback lines that are
+        not compressed.
+    :param history_spill: Move the compressed scrollback to a temporary file.
+    :param worker_pool: `WorkerPool` that parses the output of this pane in
+        another process. The screen is a `MirrorScreen` then.
+    """
     _counter = 0
 
-    def __init__(self):
+    def __init__(self, history_limit=DEFAULT_HISTORY_LIMIT,
+                 history_cold_threshold=DEFAULT_COLD_THRESHOLD, history_spill=False,
+                 worker_pool=None):
         super().__init__()
 
         self.window = None # Weakref set by window.add
@@ -94,22 +202,32 @@ class Pane(Container):
 
         self.location = Location(self.py, self.py, self.sx, self.sy)
 
+        self.worker_pool = worker_pool
+
         # Create output stream and attach to screen
-        self.screen = BetterScreen(self.sx, self.sy)
-        self.stream = pyte.Stream()
+        screen_class = MirrorScreen if worker_pool else BetterScreen
+        self.screen = screen_class(self.sx, self.sy, history_limit=history_limit,
+                                   history_cold_threshold=history_cold_threshold,
+                                   history_spill=history_spill)
+        self.stream = BetterStream()
         self.stream.attach(self.screen)
 
-        # Create pseudo terminal for this pane.
+        # Create pseudo terminal for this pane. The master side is read by a
+        # `PtyReader` (or a worker process).
         self.master, self.slave = os.openpty()
 
-        # Master side -> attached to terminal emulator.
-        self.shell_out = io.open(self.master, 'rb', 0)
-
         # Slave side -> attached to process.
         set_size(self.slave, self.sy, self.sx)
 
         self.id = self._next_id()
 
+        # Last search, for `search_next`.
+        self._search_query = None
+        self._search_backwards = False
+        self._search_match = None
+        self._search_history = None
+        self._search_dropped = 0
+
     @classmethod
     def _next_id(cls):
         cls._counter += 1
@@ -129,6 +247,66 @@ class Pane(Container):
     def panes(self):
         yield self
 
+    @property
+    def history_limit(self):
+        return self.screen.history.limit
+
+    @history_limit.setter
+    def history_limit(self, value):
+        self.screen.history.limit = value
+
+        if self.worker_pool:
+            self.worker_pool.configure_pane(self)
+
+    def search(self, pattern, regex=False, ignore_case=False, backwards=False):
+        """
+        Search the scrollback and the visible rows. Forward searches start at
+        the top of the history, backward searches at the bottom of the screen.
+        Returns a `SearchMatch` or None.
+        """
+        self._search_query = SearchQuery(pattern, regex=regex, ignore_case=ignore_case)
+        self._search_backwards = backwards
+        self._search_match = None
+
+        return self.search_next()
+
+    def search_next(self, reverse=False):
+        """
+        Find the next match of the last search. When `reverse` is set, search
+        in the opposite direction.
+        """
+        if self._search_query is None:
+            return None
+
+        history = self.screen.history
+        position = None
+
+        # The line index of the last match means nothing after switching
+        # between the normal and the alternate screen. Start over then.
+        if history is not self._search_history:
+            self._search_match = None
+
+        # Line indexes shift when the history drops lines at the top.
+        if self._search_match:
+            position = (self._search_match.line - (history.dropped - self._search_dropped),
+                        self._search_match.start)
+
+        match = self.screen.search(self._search_query, position,
+                                   backwards=self._search_backwards != reverse)
+        if match:
+            self._search_match = match
+            self._search_history = history
+            self._search_dropped = history.dropped
+
+        return match
+
+    def detach_worker(self):
+        """ Parse the output in this process again, instead of in a worker. """
+        if self.worker_pool:
+            self.worker_pool = None
+            self.screen.detach()
+            self.invalidate()
+
     def add(self, child):
         # Pane is a leaf node. Disallow
         raise Exception('Not allowed to add childnodes to a Pane node.')
@@ -146,6 +324,9 @@ class Pane(Container):
         self.screen.resize(self.sy, self.sx)
         set_size(self.slave, self.sy, self.sx)
 
+        if self.worker_pool:
+            self.worker_pool.configure_pane(self)
+
         self.invalidate()
 
 
@@ -163,20 +344,7 @@ class Pane(Container):
         return self.screen.cursor.y, self.screen.cursor.x
 
     def _get_border_type(self, x, y):
-        return {
-            CellPosition.TopBorder: BorderType.Horizontal,
-            CellPosition.BottomBorder: BorderType.Horizontal,
-            CellPosition.LeftBorder: BorderType.Vertical,
-            CellPosition.RightBorder: BorderType.Vertical,
-
-            CellPosition.TopLeftBorder: BorderType.TopLeft,
-            CellPosition.TopRightBorder: BorderType.TopRight,
-            CellPosition.BottomLeftBorder: BorderType.BottomLeft,
-            CellPosition.BottomRightBorder: BorderType.BottomRight,
-
-            CellPosition.Inside: BorderType.Inside,
-            CellPosition.Outside: BorderType.Outside,
-        }[ self._get_cell_position(x,y) ]
+        return _BORDER_TYPES[self._get_cell_position(x, y)]
 
     def is_inside(self, x, y):
         """ True when this coordinate appears inside this pane. """
@@ -218,23 +386,43 @@ class Pane(Container):
 
 
 class ExecPane(Pane):
-    def __init__(self, pane_executor=None):
-        super().__init__()
+    """
+    :param read_drain: Maximum amount of reads from the pseudo terminal per
+        wakeup of the event loop. (See `PtyReader`.)
+    """
+    def __init__(self, pane_executor=None, read_drain=DEFAULT_READ_DRAIN, **kwargs):
+        super().__init__(**kwargs)
 
         self.pane_executor = pane_executor
+        self.reader = PtyReader(self.master, self.write_output, drain=read_drain)
         self.finished = False
         self.process_id = None
 
+    def detach_worker(self):
+        if self.worker_pool:
+            super().detach_worker()
+
+            if not self.finished:
+                self.reader.start()
+
     @asyncio.coroutine
     def run(self):
         try:
-            # Connect read pipe to process
-            read_transport, read_protocol = yield from loop.connect_read_pipe(
-                                lambda:SubProcessProtocol(self.write_output), self.shell_out)
+            # Start reading the output of the process. (Or let a worker
+            # process read it.)
+            if self.worker_pool:
+                self.worker_pool.add_pane(self)
+            else:
+                self.reader.start()
 
             # Run process in executor, wait for that to finish.
             yield from self._run_fork()
 
+            if self.worker_pool:
+                self.worker_pool.remove_pane(self)
+            else:
+                self.reader.stop()
+
             # Set finished.
             self.finished = True # TODO: close pseudo terminal.
         except Exception as e:
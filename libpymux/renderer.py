@@ -4,12 +4,15 @@ import asyncio
 import fcntl
 import pyte
 import datetime
-from collections import namedtuple
+import functools
+import unicodedata
+from collections import deque, namedtuple
 
 from .utils import get_size
 from .log import logger
 from .panes import CellPosition, BorderType
 from .invalidate import Redraw
+from .styles import style_table, TRUECOLOUR, COLOUR_256
 
 loop = asyncio.get_event_loop()
 
@@ -35,16 +38,198 @@ BorderSymbols = {
     BorderType.Outside: 'x',
 }
 
+#: `BorderSymbols`, encoded.
+_ENCODED_BORDER_SYMBOLS = dict((k, v.encode('utf-8')) for k, v in BorderSymbols.items())
+
 reverse_colour_code = dict((v, k) for k, v in pyte.graphics.FG.items())
 reverse_bgcolour_code = dict((v, k) for k, v in pyte.graphics.BG.items())
 
+_style_sgr_cache = {}
+
+#: Amount of (previous style, next style) pairs for which the transition is
+#: remembered.
+SGR_TRANSITION_CACHE_SIZE = 1024
+
+#: Amount of escape sequences with parameters (like cursor positions) for
+#: which the encoded bytes are remembered.
+ESCAPE_SEQUENCE_CACHE_SIZE = 4096
+
+#: Amount of distinct characters of which the encoding is remembered.
+ENCODED_CHAR_CACHE_SIZE = 4096
+
+_encoded_chars = {}
+
+#: (attribute, SGR parameter to set it, SGR parameter to unset it)
+_BOOLEAN_ATTRIBUTES = [
+    ('bold', 1, 22),
+    ('italics', 3, 23),
+    ('underscore', 4, 24),
+    ('strikethrough', 9, 29),
+    ('reverse', 7, 27),
+]
+
+
+@functools.lru_cache(maxsize=ESCAPE_SEQUENCE_CACHE_SIZE)
+def _escape(template, *params):
+    """ Encoded escape sequence: `template` formatted with `params`. """
+    return (template % params).encode('ascii')
+
+
+def _encode_char(char):
+    """ UTF-8 encoding of a character, cached for the most common ones. """
+    try:
+        return _encoded_chars[char]
+    except KeyError:
+        result = char.encode('utf-8')
+        if len(_encoded_chars) < ENCODED_CHAR_CACHE_SIZE:
+            _encoded_chars[char] = result
+        return result
+
+
+def _colour_sgr(colour, colour_codes, extended):
+    """ SGR parameters for a colour. `extended` is 38 (fg) or 48 (bg). """
+    if isinstance(colour, int):
+        if colour >= TRUECOLOUR:
+            return '%i;2;%i;%i;%i' % (extended, colour >> 16 & 0xff, colour >> 8 & 0xff, colour & 0xff)
+        else: # 256 colour
+            return '%i;5;%i' % (extended, colour - COLOUR_256)
+    else:
+        return '%i' % colour_codes[colour]
+
+
+def get_style_sgr(style_id):
+    """
+    Escape sequence that selects this style, starting from a reset. The
+    encoded sequences are cached per style ID.
+    """
+    try:
+        return _style_sgr_cache[style_id]
+    except KeyError:
+        style = style_table[style_id]
+        params = ['0']
+
+        if style.fg != 'default':
+            params.append(_colour_sgr(style.fg, reverse_colour_code, 38))
+
+        if style.bg != 'default':
+            params.append(_colour_sgr(style.bg, reverse_bgcolour_code, 48))
+
+        for name, on, off in _BOOLEAN_ATTRIBUTES:
+            if getattr(style, name):
+                params.append('%i' % on)
+
+        result = ('\033[%sm' % ';'.join(params)).encode('ascii')
+        _style_sgr_cache[style_id] = result
+        return result
+
+
+@functools.lru_cache(maxsize=SGR_TRANSITION_CACHE_SIZE)
+def get_style_transition(previous_style_id, style_id):
+    """
+    Shortest escape sequence that changes the attributes of the terminal
+    from the previous style into this style: one SGR sequence with only the
+    parameters that differ, or the full sequence when a reset is shorter.
+    """
+    if previous_style_id == style_id:
+        return b''
+
+    previous = style_table[previous_style_id]
+    style = style_table[style_id]
+    params = []
+
+    if style.fg != previous.fg:
+        if style.fg == 'default':
+            params.append('39')
+        else:
+            params.append(_colour_sgr(style.fg, reverse_colour_code, 38))
+
+    if style.bg != previous.bg:
+        if style.bg == 'default':
+            params.append('49')
+        else:
+            params.append(_colour_sgr(style.bg, reverse_bgcolour_code, 48))
+
+    for name, on, off in _BOOLEAN_ATTRIBUTES:
+        value = getattr(style, name)
+        if value != getattr(previous, name):
+            params.append('%i' % (on if value else off))
+
+    result = ('\033[%sm' % ';'.join(params)).encode('ascii')
+    full = get_style_sgr(style_id)
+
+    return full if len(full) <= len(result) else result
+
+
+#: Minimum amount of blanks that are erased (ECH or EL) instead of sent as
+#: spaces.
+MIN_ERASE_LENGTH = 8
+
+
+def _can_erase(style_id):
+    """
+    True when erased cells look like blanks of this style: they get the
+    background colour, but not the other attributes.
+    """
+    style = style_table[style_id]
+    return not (style.reverse or style.underscore or style.strikethrough)
+
+
+def _can_repeat(char, count):
+    """ True when REP is shorter than repeating this character. """
+    if unicodedata.combining(char) or unicodedata.east_asian_width(char) in 'WF':
+        return False
+
+    return len(char.encode('utf-8')) * (count - 1) > len('\033[%ib' % (count - 1))
+
+
+#: Default maximum amount of bytes that are queued for a renderer. When a
+#: client is slower, its queued frames are dropped, and it gets one full
+#: repaint after it has caught up.
+DEFAULT_MAX_BACKLOG = 512 * 1024
+
 
 class Renderer:
+    #: True when the terminal understands REP (repeat the preceding character),
+    #: like xterm, VTE and tmux do. Runs of the same character are sent once then.
+    supports_repeat = False
+
+    #: True when the terminal understands synchronized output (DEC private
+    #: mode 2026). Every frame is wrapped in a synchronized update then, so
+    #: that the terminal never shows a frame partially drawn.
+    supports_synchronized_output = False
+
+    max_backlog = DEFAULT_MAX_BACKLOG
+
     def __init__(self, client_ref):
         # Invalidate state
         self.get_client = client_ref # TODO: rename to session_ref
         self._last_size = None
 
+        # (border map, output) of the last border repaint.
+        self._border_cache = None
+
+        # What the terminal displays: maps the panes to a copy of their
+        # visible rows (see `BetterScreen.dump_lines`) as they were during
+        # the last repaint. None when unknown, then the next repaint is a
+        # full one.
+        self.shadow = None
+
+        # Output queue. Frames are written by `_drain`, concurrently with the
+        # other renderers. While writing, new frames are queued, and sent
+        # together in the next write.
+        self._frames = deque()
+        self._queued_bytes = 0
+        self._writing_bytes = 0
+        self._drain_task = None
+
+        # True after frames have been dropped, until the queue is empty.
+        # Meanwhile, nothing is rendered for this renderer.
+        self.behind = False
+
+        # Statistics.
+        self.frames_written = 0
+        self.frames_dropped = 0
+
     def get_size(self):
         raise NotImplementedError
 
@@ -53,35 +238,142 @@ class Renderer:
         raise NotImplementedError
 
     @asyncio.coroutine
-    def repaint(self, invalidated_parts, char_buffers):
-        """ Do repaint now. """
-        start = datetime.datetime.now()
+    def repaint(self, invalidated_parts, char_buffers, scrolls=None):
+        """ Do repaint now, and wait until the output has been written. """
+        self.write_frame(self.render(invalidated_parts, char_buffers, scrolls))
+        yield from self.flush()
+
+    def can_scroll(self, pane):
+        """
+        True when rows of this pane can be moved by scrolling the terminal.
+        The scrolling region contains complete rows, so the pane has to be
+        as wide as the terminal.
+        """
+        return pane.px == 0 and pane.sx >= self.get_size().x
+
+    def get_frame_key(self, invalidated_parts):
+        """
+        Renderers with the same key produce the same output for the same
+        diffs. Such a frame is rendered once and written to all of them.
+        """
+        return (invalidated_parts, self.get_size(), self._last_size, self.supports_repeat,
+                self.supports_synchronized_output)
 
-        # Build and write output
-        data = ''.join(self._repaint(invalidated_parts, char_buffers))
-        yield from self._write_output(data) # TODO: make _write_output asynchronous.
+    def render(self, invalidated_parts, char_buffers, scrolls=None):
+        """
+        Build the output of a repaint, as bytes. `scrolls` maps panes to the
+        rows that have to be scrolled before applying their diff. (See
+        `BetterScreen.get_scroll`.)
+        """
+        start = datetime.datetime.now()
+        data = bytes(self._repaint(invalidated_parts, char_buffers, scrolls or {}))
 
         #logger.info('Bytes: %r' % data)
         logger.info('Redraw generation done in %ss, bytes=%i' %
                 (datetime.datetime.now() - start, len(data)))
+        return data
 
-    def _repaint(self, invalidated_parts, char_buffers):
-        data = []
-        write = data.append
+    def write_frame(self, data):
+        """
+        Queue a frame that was rendered by this renderer, or by one with the
+        same frame key. Returns False when the frame was dropped instead,
+        because the backlog would become larger than `max_backlog`.
+        """
+        # After rendering, the background has the current size.
+        self._last_size = self.get_size()
+
+        if self.backlog + len(data) > self.max_backlog and self._drain_task:
+            # Drop everything that's not being written yet. What the terminal
+            # displays is unknown now.
+            logger.info('Output backlog of %i bytes, dropping frames.' % self.backlog)
+            self.frames_dropped += len(self._frames) + 1
+            self._frames.clear()
+            self._queued_bytes = 0
+            self.shadow = None
+            self.behind = True
+            return False
+
+        self._frames.append(data)
+        self._queued_bytes += len(data)
+
+        if not self._drain_task:
+            self._drain_task = asyncio.async(self._drain())
+        return True
+
+    @property
+    def backlog(self):
+        """ Amount of bytes that are queued or being written. """
+        return self._queued_bytes + self._writing_bytes
+
+    @asyncio.coroutine
+    def _drain(self):
+        try:
+            while self._frames:
+                count = len(self._frames)
+                data = b''.join(self._frames)
+                self._frames.clear()
+                self._queued_bytes = 0
+                self._writing_bytes = len(data)
+
+                yield from self._write_output(data)
+                self.frames_written += count
+                self._writing_bytes = 0
+        except Exception as e:
+            logger.error('Writing output failed: %r' % e)
+
+            # Whatever was written, the next repaint has to be a full one.
+            self._frames.clear()
+            self._queued_bytes = 0
+            self.shadow = None
+            self.behind = True
+        finally:
+            self._writing_bytes = 0
+            self._drain_task = None
+
+        if self.behind:
+            # Caught up, or gave up on the queued frames. Repaint everything.
+            self.behind = False
+            session = self.get_client()
+            if session:
+                session.invalidate(Redraw.Nothing)
+
+    @asyncio.coroutine
+    def flush(self):
+        """ Wait until all queued frames have been written. """
+        while self._drain_task:
+            yield from self._drain_task
+
+    def get_output_stats(self):
+        return {
+            'size': list(self.get_size()),
+            'backlog': self.backlog,
+            'max_backlog': self.max_backlog,
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+        }
+
+    def _repaint(self, invalidated_parts, char_buffers, scrolls):
+        """ Build the output as a `bytearray` of encoded fragments. """
+        data = bytearray()
+        write = data.extend
         client = self.get_client()
 
+        if self.supports_synchronized_output:
+            write(b'\033[?2026h') # Begin synchronized update
+
         if invalidated_parts & Redraw.ClearFirst:
-            write('\u001b[2J') # Erase screen
+            write(b'\033[2J') # Erase screen
 
         # Hide cursor
-        write('\033[?25l')
+        write(b'\033[?25l')
 
         # Draw panes.
         if invalidated_parts & Redraw.Panes and client.active_window:
             only_dirty = not bool(invalidated_parts & Redraw.ClearFirst)
             logger.info('Redraw panes')
             for pane in client.active_window.panes:
-                data += self._repaint_pane(pane, only_dirty=only_dirty, char_buffer=char_buffers[pane])
+                data += self._repaint_pane(pane, only_dirty=only_dirty, char_buffer=char_buffers[pane],
+                                           scroll=scrolls.get(pane))
 
         # Draw borders
         if invalidated_parts & Redraw.Borders and client.active_window:
@@ -101,84 +393,95 @@ class Renderer:
 
         if active_pane and not active_pane.screen.cursor.hidden:
             ypos, xpos = active_pane.cursor_position
-            write('\033[%i;%iH' % (active_pane.py + ypos+1, active_pane.px + xpos+1))
+            write(_escape('\033[%i;%iH', active_pane.py + ypos+1, active_pane.px + xpos+1))
 
             # Make cursor visible
-            write('\033[?25h')
+            write(b'\033[?25h')
 
             # Set arrows in application/cursor sequences.
             # (Applications like Vim expect an other kind of cursor sequences.
             # This mode is the way of telling the VT terminal which sequences
             # it should send.)
             if (1 << 5) in active_pane.screen.mode:
-                write('\033[?1h') # Set application sequences
+                write(b'\033[?1h') # Set application sequences
             else:
-                write('\033[?1l') # Reset
+                write(b'\033[?1l') # Reset
+
+        if self.supports_synchronized_output:
+            write(b'\033[?2026l') # End synchronized update
 
         invalidated_parts = Redraw.Nothing
 
         return data
 
     def _repaint_border(self, client):
-        data = []
-        write = data.append
+        border_map = client.active_window.get_border_map(client.sx, client.sy - 1)
 
-        for y in range(0, client.sy - 1):
-            write('\033[%i;%iH' % (y+1, 0))
+        # The output only changes when the layout changes.
+        if self._border_cache is None or self._border_cache[0] is not border_map:
+            self._border_cache = (border_map, bytes(self._render_border_map(border_map)))
 
-            for x in range(0, client.sx):
-                border_type, is_active = self._check_cell(client, x, y)
+        return self._border_cache[1]
 
-                if border_type and border_type != BorderType.Inside:
-                    write('\033[%i;%iH' % (y+1, x+1)) # XXX: we don't have to send this every time. Optimize.
-                    write('\033[0m') # Reset colour
+    def _render_border_map(self, border_map):
+        """ Write the border cells, one run of adjacent cells at a time. """
+        data = bytearray()
+        write = data.extend
+        last = None
 
-                    if is_active:
-                        write('\033[0;%im' % 32)
+        for (y, x), (border_type, is_active) in sorted(border_map.items()):
+            if last != (y, x - 1, is_active):
+                write(_escape('\033[%i;%iH', y + 1, x + 1))
+                write(b'\033[0;32m' if is_active else b'\033[0m')
 
-                    write(BorderSymbols[border_type])
+            write(_ENCODED_BORDER_SYMBOLS[border_type])
+            last = (y, x, is_active)
 
         return data
 
     def _repaint_background(self, client):
-        data = []
+        data = bytearray()
         size = self.get_size()
 
         # Only redraw background when the size has been changed.
-        write = data.append
+        write = data.extend
 
-        write('\033[37m') # white fg
-        write('\033[43m') # yellow bg
+        write(b'\033[37m') # white fg
+        write(b'\033[43m') # yellow bg
         width, height = size
 
         sx = client.sx
         sy = client.sy
 
+        # Fill the part of every row outside the layout, with one cursor
+        # movement per row.
         for y in range(0, height - 1):
-            for x in range(0, width):
-                if x >= sx or y >= sy:
-                    write('\033[%i;%iH.' % (y+1, x+1))
+            start = 0 if y >= sy else sx
+
+            if start < width:
+                write(_escape('\033[%i;%iH', y+1, start+1))
+                write(b'.' * (width - start))
 
         self._last_size = size
         return data
 
     def _repaint_status_bar(self, client):
-        data = []
-        write = data.append
+        data = bytearray()
+        write = data.extend
 
         width, height = self.get_size()
 
         # Go to bottom line
-        write('\033[%i;0H' % height)
+        write(_escape('\033[%i;0H', height))
 
         # Set background
-        write('\033[%im' % 43) # Brown
+        write(b'\033[43m') # Brown
 
         # Set foreground
-        write('\033[%im' % 30) # Black
+        write(b'\033[30m') # Black
 
         # Set bold
-        write('\033[1m')
+        write(b'\033[1m')
 
         text = client.status_bar.left_text
         rtext = client.status_bar.right_text
@@ -187,99 +490,92 @@ class Renderer:
 
         text += ' ' * space_left + rtext
         text = text[:width]
-        write(text)
+        write(text.encode('utf-8'))
 
         return data
 
-    def _repaint_pane(self, pane, only_dirty=True, char_buffer=None): # TODO: remove only_dirty
-        data = []
-        write = data.append
+    def _repaint_pane(self, pane, only_dirty=True, char_buffer=None, scroll=None): # TODO: remove only_dirty
+        data = bytearray()
+        write = data.extend
+        encoded_chars = _encoded_chars
 
-        last_fg = 'default'
-        last_bg = 'default'
-        last_bold = False
-        last_underscore = False
-        last_reverse = False
-        last_pos = (-10, -10)
+        last_style = 0
 
-        write('\033[0m')
+        # Position of the terminal cursor, relative to the pane.
+        cursor = None
 
-        for line_index, line_data in char_buffer.items():
-            for column_index, char in line_data.items():
-                # Only send position when it it's not next to the last one.
-                if (line_index, column_index + pane.px) == (last_pos[0] + 1, 0):
-                    write('\r\n') # Optimization for the next line
-                elif (line_index, column_index) != (last_pos[0], last_pos[1] + 1):
-                    write('\033[%i;%iH' % (pane.py + line_index + 1, pane.px + column_index + 1))
-                                # TODO: also optimize if the last skipped character is a space.
-                last_pos = (line_index, column_index)
-
-                # If the bold/underscore/reverse parameters are reset.
-                # Always use global reset.
-                if (last_bold and not char.bold) or \
-                                    (last_underscore and not char.underscore) or \
-                                    (last_reverse and not char.reverse):
-                    write('\033[0m')
-
-                    last_fg = 'default'
-                    last_bg = 'default'
-                    last_bold = False
-                    last_underscore = False
-                    last_reverse = False
-
-                if char.fg != last_fg:
-                    colour_code = reverse_colour_code.get(char.fg, None)
-                    if colour_code:
-                        write('\033[0;%im' % colour_code)
-                    else: # 256 colour
-                        write('\033[38;5;%im' % (char.fg - 1024))
-                    last_fg = char.fg
-
-                if char.bg != last_bg:
-                    colour_code = reverse_bgcolour_code.get(char.bg, None)
-                    if colour_code:
-                        write('\033[%im' % colour_code)
-                    else: # 256 colour
-                        write('\033[48;5;%im' % (char.bg - 1024))
-                    last_bg = char.bg
-
-                if char.bold and not last_bold:
-                    write('\033[1m')
-                    last_bold = char.bold
-
-                if char.underscore and not last_underscore:
-                    write('\033[4m')
-                    last_underscore = char.underscore
-
-                if char.reverse and not last_reverse:
-                    write('\033[7m')
-                    last_reverse = char.reverse
-
-                write(char.data)
+        # Erasing until the end of the line is only allowed when there are no
+        # other panes at the right.
+        at_right_edge = pane.px + pane.sx >= self.get_size().x
 
-        return data
+        write(b'\033[0m')
 
-    def _check_cell(self, client, x, y):
-        """ For a given (x,y) cell, return the pane to which this belongs, and
-        the type of border we have there.
+        if scroll:
+            # Move the rows with the scrolling region set to these rows of
+            # the pane: delete lines at the top to move them up, insert lines
+            # to move them down. The new rows are blank, in the default style.
+            top, bottom, amount = scroll
+            write(_escape('\033[%i;%ir', pane.py + top + 1, pane.py + bottom + 1))
+            write(_escape('\033[%i;%iH', pane.py + top + 1, pane.px + 1))
 
-        :returns: BorderType
-        """
-        # Create mask: set bits when the touching cells are borders.
-        mask = 0
-        is_active = False
+            if amount > 0:
+                write(_escape('\033[%iM', amount))
+            else:
+                write(_escape('\033[%iL', -amount))
+
+            # Reset the scrolling region. This moves the cursor home.
+            write(b'\033[r')
 
-        for pane in client.active_window.panes:
-            border_type = pane._get_border_type(x, y)
+        for line_index, line_data in sorted(char_buffer.items()):
+            cells = sorted(line_data.items())
+            cell_count = len(cells)
+            i = 0
 
-            # If inside pane:
-            if border_type == BorderType.Inside:
-                return border_type, False
+            while i < cell_count:
+                column_index, cell = cells[i]
+                char, style = cell
 
-            mask |= border_type
-            is_active = is_active or (border_type and pane == client.active_pane)
+                # Length of the run of equal cells, starting here.
+                count = 1
+                while (i + count < cell_count and cells[i + count][1] == cell and
+                       cells[i + count][0] == column_index + count):
+                    count += 1
 
-        return mask, is_active
+                # Only send position when it it's not next to the last one.
+                if cursor != (line_index, column_index):
+                    if cursor and cursor[0] + 1 == line_index and pane.px + column_index == 0:
+                        write(b'\r\n') # Optimization for the next line
+                    elif cursor and cursor[0] == line_index and 0 < column_index - cursor[1] < 1000:
+                        write(_escape('\033[%iC', column_index - cursor[1])) # Forward
+                    else:
+                        write(_escape('\033[%i;%iH', pane.py + line_index + 1, pane.px + column_index + 1))
+
+                if style != last_style:
+                    write(get_style_transition(last_style, style))
+                    last_style = style
+
+                if char == ' ' and count >= MIN_ERASE_LENGTH and _can_erase(style):
+                    # Erase the blanks, this fills them with the background
+                    # colour of the current style. The cursor doesn't move.
+                    if at_right_edge and column_index + count >= pane.sx:
+                        write(b'\033[K')
+                    else:
+                        write(_escape('\033[%iX', count))
+                    cursor = (line_index, column_index)
+
+                elif count > 1 and self.supports_repeat and _can_repeat(char, count):
+                    write(_encode_char(char))
+                    write(_escape('\033[%ib', count - 1))
+                    cursor = (line_index, column_index + count)
+
+                else:
+                    encoded = encoded_chars.get(char) or _encode_char(char)
+                    write(encoded * count if count > 1 else encoded)
+                    cursor = (line_index, column_index + count)
+
+                i += count
+
+        return data
 
 
 class PipeRenderer(Renderer):
@@ -289,7 +585,7 @@ class PipeRenderer(Renderer):
 
     @asyncio.coroutine
     def _write_output(self, data):
-        self._write_func(data.encode('utf-8'))
+        self._write_func(data)
 
     def get_size(self):
         y, x = get_size(sys.stdout)
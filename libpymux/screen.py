@@ -2,20 +2,31 @@
 Custom `Screen` class for the `pyte` library.
 
 Changes compared to the original `Screen` class:
-    - We store the layout in a dict instead of a list, in order to have a
-      scalable window. When the window size is reduced and increased again, the
-      hidden text will appear again.
-    - 256 colour support (xterm)
-    - Per character diffs instead of per line diffs.
+    - Scalable window. When the window size is reduced and increased again,
+      the hidden text will appear again.
+    - Lines that are scrolled off the top are kept in a bounded `History`,
+      older lines are compressed.
+    - 256 colour and true colour support (xterm)
+    - Per character diffs instead of per line diffs. The screen keeps track of
+      the rows (and column spans) that were touched since the last repaint, so
+      only those have to be compared.
+    - Every row is a `Line`: an array of code points with a parallel array of
+      style IDs, instead of a dict of `Char` instances.
 """
-from collections import defaultdict
+from array import array
 from pyte import charsets as cs
 from pyte import modes as mo
-from pyte.graphics import FG, BG
+from pyte.graphics import FG, BG, TEXT
 from pyte.screens import Margins, Cursor, Char
+import functools
 import pyte
+import sys
 
+from .history import History, DEFAULT_HISTORY_LIMIT, DEFAULT_COLD_THRESHOLD
+from .line import Line, SPACE, _BLANK_STYLES
+from .search import SearchMatch
 from .log import logger
+from .styles import style_table, DEFAULT_STYLE, COLOUR_256, TRUECOLOUR
 
 
 # Patch pyte.graphics to accept High intensity colours as well.
@@ -47,6 +58,169 @@ BG.update({
 })
 
 
+_EMPTY_LINE = Line()
+
+#: Dirty span of a row that has to be compared completely.
+FULL_ROW = (0, sys.maxsize)
+
+
+#: Amount of (style, attributes) pairs that `apply_sgr` remembers.
+SGR_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=SGR_CACHE_SIZE)
+def apply_sgr(style_id, attrs):
+    """
+    Return the ID of the style that we get when applying these "select
+    graphic rendition" parameters (a tuple) to the given style.
+
+    Applications send the same few SGR sequences over and over again, so the
+    results are memoized. (`apply_sgr.cache_info()` has the hit and miss
+    counters.) This is possible because style IDs never change.
+    """
+    replace = {}
+
+    if not attrs:
+        attrs = [0]
+    else:
+        attrs = list(attrs[::-1])
+
+    while attrs:
+        attr = attrs.pop()
+
+        if attr in FG:
+            replace["fg"] = FG[attr]
+        elif attr in BG:
+            replace["bg"] = BG[attr]
+        elif attr in TEXT:
+            attr = TEXT[attr]
+            replace[attr[1:]] = attr.startswith("+")
+        elif not attr:
+            replace = DEFAULT_STYLE._asdict()
+
+        elif attr in (38, 48) and attrs:
+            key = "fg" if attr == 38 else "bg"
+            n = attrs.pop()
+
+            if n == 5 and attrs:
+                # 256 colours: 38;5;n
+                replace[key] = COLOUR_256 + attrs.pop()
+
+            elif n == 2 and len(attrs) >= 3:
+                # True colour: 38;2;r;g;b
+                r, g, b = attrs.pop(), attrs.pop(), attrs.pop()
+                replace[key] = TRUECOLOUR | (r & 0xff) << 16 | (g & 0xff) << 8 | (b & 0xff)
+
+    return style_table.replace(style_id, **replace)
+
+
+def _to_char(code_point, style_id):
+    return style_table[style_id]._replace(data=chr(code_point))
+
+
+class _LineView:
+    """
+    Access to a `Line` as a mapping of `Char` instances. When `screen` is
+    given, changes are reported as dirty cells of visible row `y`.
+    """
+    def __init__(self, line, screen=None, y=None):
+        self._line = line
+        self._screen = screen
+        self._y = y
+
+    def __getitem__(self, x):
+        return _to_char(*self._line.get(x))
+
+    def __setitem__(self, x, char):
+        self._line.set(x, ord(char.data), style_table.intern(char))
+        self._changed(x)
+
+    def __delitem__(self, x):
+        self._line.erase(x, x + 1)
+        self._changed(x)
+
+    def _changed(self, x):
+        if self._screen is not None:
+            self._screen._mark_cells_dirty(self._y, x, x + 1)
+
+    def __contains__(self, x):
+        return 0 <= x < len(self._line)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._line)
+
+    def get(self, x, default=None):
+        return self[x] if x in self else default
+
+    def keys(self):
+        return range(len(self._line))
+
+    def values(self):
+        return (self[x] for x in self.keys())
+
+    def items(self):
+        return ((x, self[x]) for x in self.keys())
+
+
+class _BufferView:
+    """
+    Compatibility accessor for code that still indexes the screen as
+    ``buffer[y][x]``, like the `buffer` of the original dict-based
+    `BetterScreen`. (`y` includes the line offset, so the history comes
+    first.) Every access creates a `Char`, so this is slow. New code should
+    use the `Line` objects.
+    """
+    def __init__(self, screen):
+        self._screen = screen
+
+    def __getitem__(self, y):
+        screen = self._screen
+        row = y - screen.line_offset
+
+        if row >= 0:
+            return _LineView(screen.get_line(y), screen, row)
+        else:
+            return _LineView(screen.get_line(y))
+
+    def __contains__(self, y):
+        return 0 <= y < len(self)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._screen.history) + self._screen.lines
+
+    def keys(self):
+        return range(len(self))
+
+    def values(self):
+        return (self[y] for y in self.keys())
+
+    def items(self):
+        return ((y, self[y]) for y in self.keys())
+
+
+class BetterCursor(Cursor):
+    """
+    Cursor that carries a style ID instead of a `Char` with attributes, so
+    drawing a character doesn't have to create a new `Char`.
+    """
+    def __init__(self, x, y, style=0):
+        self.x, self.y, self.style, self.hidden = x, y, style, False
+
+    @property
+    def attrs(self):
+        return style_table[self.style]
+
+    @attrs.setter
+    def attrs(self, value):
+        self.style = style_table.intern(value)
+
+
 class BetterScreen(pyte.Screen):
     swap_variables = [
             'mode',
@@ -56,25 +230,128 @@ class BetterScreen(pyte.Screen):
             'g1_charset',
             'tabstops',
             'cursor',
-            'line_offset',
+            'history',
             ]
 
-    def __init__(self, lines, columns):
+    def __init__(self, lines, columns, history_limit=DEFAULT_HISTORY_LIMIT,
+                 history_cold_threshold=DEFAULT_COLD_THRESHOLD, history_spill=False):
         self.lines = lines
         self.columns = columns
+        self.savepoints = []
+        self.history = History(history_limit, cold_threshold=history_cold_threshold,
+                               spill=history_spill)
         self.reset()
 
     def __before__(self, command):
         return
         logger.info('              %r' % command)
 
+    @property
+    def buffer(self):
+        return _BufferView(self)
+
+    @property
+    def line_offset(self):
+        """ Index of the line that's currently displayed on top. """
+        return len(self.history)
+
+    def get_line(self, index):
+        """
+        Return the `Line` at this index, counting from the top of the history.
+        (The visible rows start at `line_offset`.)
+        """
+        history_size = len(self.history)
+
+        if index < history_size:
+            return self.history[index]
+        else:
+            return self._rows[index - history_size]
+
+    def search(self, query, position=None, backwards=False):
+        """
+        Find the next match of this `SearchQuery` in the history and the
+        visible rows. Returns a `SearchMatch` or None.
+
+        :param position: (line, column) tuple. Only matches that start after
+            this position (or before it, when `backwards` is set) are
+            returned. When None, search from the top of the history (or from
+            the bottom of the screen, when `backwards` is set.)
+        """
+        history_size = len(self.history)
+        total = history_size + len(self._rows)
+
+        # Remainder of the line at the start position.
+        if position is None:
+            index = total - 1 if backwards else 0
+        else:
+            index, column = position
+
+            if 0 <= index < total:
+                text = self.get_line(index).text
+                if backwards:
+                    span = query.search_line(text, end=column, backwards=True)
+                else:
+                    span = query.search_line(text, start=column + 1)
+
+                if span:
+                    return SearchMatch(index, *span)
+
+            if backwards:
+                index = min(index - 1, total - 1)
+            else:
+                index = max(index + 1, 0)
+
+        step = -1 if backwards else 1
+
+        # Visible rows, when searching backwards they come first.
+        while history_size <= index < total:
+            span = query.search_line(self._rows[index - history_size].text, backwards=backwards)
+            if span:
+                return SearchMatch(index, *span)
+
+            index += step
+
+        # History.
+        if 0 <= index < history_size:
+            result = self.history.search(query, index, backwards=backwards)
+            if result:
+                return SearchMatch(result[0], *result[1])
+
+            if not backwards:
+                index = history_size
+
+        # Visible rows after the history.
+        while history_size <= index < total:
+            span = query.search_line(self._rows[index - history_size].text)
+            if span:
+                return SearchMatch(index, *span)
+
+            index += step
+
+    def memory_usage(self):
+        """
+        Approximate memory usage: the history statistics (see
+        `History.memory_usage`) and the bytes used by the visible rows.
+        """
+        result = self.history.memory_usage()
+        result['visible_bytes'] = sum(
+                sys.getsizeof(l) + sys.getsizeof(l.chars) + sys.getsizeof(l.styles)
+                for l in self._rows)
+        return result
+
     def reset(self):
-        self.buffer = defaultdict(lambda: defaultdict(lambda: Char(data=' ')))
+        # The visible rows, one `Line` for each.
+        self._rows = [ Line() for _ in range(self.lines) ]
+        self.history.clear()
+
+        # Changes since the last repaint: maps the index of a visible row to
+        # a (start, end) span of columns.
+        self.dirty = {}
+        self._mark_dirty()
+
         self.mode = set([mo.DECAWM, mo.DECTCEM])
         self.margins = Margins(0, self.lines - 1)
 
-        self.line_offset = 0 # Index of the line that's currently displayed on top.
-
         # According to VT220 manual and ``linux/drivers/tty/vt.c``
         # the default G0 charset is latin-1, but for reasons unknown
         # latin-1 breaks ascii-graphics; so G0 defaults to cp437.
@@ -87,52 +364,197 @@ class BetterScreen(pyte.Screen):
         # we aim to support VT102 / VT220 and linux -- we use n = 8.
         self.tabstops = set(range(7, self.columns, 8))
 
-        self.cursor = Cursor(0, 0)
+        self.cursor = BetterCursor(0, 0)
         self.cursor_position()
 
-    def dump_character_diff(self, previous_dump):
+    def _mark_dirty(self, start=0, end=None):
+        """ Mark the visible rows from `start` to `end` (exclusive) as changed. """
+        if end is None:
+            end = self.lines
+        self.dirty.update(dict.fromkeys(range(start, end), FULL_ROW))
+
+    def _mark_cells_dirty(self, y, start, end):
+        """ Mark the cells of row `y` from `start` to `end` (exclusive) as changed. """
+        span = self.dirty.get(y)
+
+        if span is None:
+            self.dirty[y] = (start, end)
+        elif span is not FULL_ROW:
+            self.dirty[y] = (min(start, span[0]), max(end, span[1]))
+
+    def get_scroll(self, previous_dump):
+        """
+        Detect whether the rows that changed since `previous_dump` are mostly
+        the same rows, moved up or down. Returns a (top, bottom, amount)
+        tuple: the rows from `top` to `bottom` (inclusive) moved up by
+        `amount` (or down, when `amount` is negative.) None when they didn't.
         """
-        Create a copy of the visible buffer.
+        if previous_dump is None or len(previous_dump) != self.lines:
+            return None
+
+        moved = [ y for y, span in self.dirty.items() if span is FULL_ROW and y < self.lines ]
+        if len(moved) < 2:
+            return None
+
+        top, bottom = min(moved), max(moved)
+        columns = self.columns
+
+        def key(line):
+            return line.chars[:columns].tobytes(), line.styles[:columns].tobytes()
+
+        # Where every row was. (Rows that occur more than once, like blank
+        # rows, don't tell anything.)
+        positions = {}
+        for y in range(top, bottom + 1):
+            k = key(previous_dump[y])
+            positions[k] = None if k in positions else y
+
+        # Count for every amount how many rows moved by that amount.
+        votes = {}
+        for y in range(top, bottom + 1):
+            previous_y = positions.get(key(self._rows[y]))
+            if previous_y is not None and previous_y != y:
+                amount = previous_y - y
+                votes[amount] = votes.get(amount, 0) + 1
+
+        if votes:
+            amount = max(votes, key=votes.get)
+
+            # Worth it when at least half of the rows that stay visible in
+            # the region are kept.
+            if votes[amount] * 2 >= bottom - top + 1 - abs(amount):
+                return top, bottom, amount
+
+    def dump_character_diff(self, previous_dump, scroll=None):
         """
-        space = Char(data=' ')
-        result = defaultdict(lambda: defaultdict(lambda: Char(data=' ')))
-        offset = self.line_offset
+        Create a diff of the visible buffer against `previous_dump`, as a
+        dict of dicts of (data, style_id) tuples. `previous_dump` is what
+        `dump_lines` returned during the previous repaint (or `None` to dump
+        everything.)
 
-        def chars_eq(c1, c2):
-            return c1 == c2 #or (c1.data == ' ' and c2.data == ' ') # TODO: unless they have a background or underline, etc...
+        When `scroll` is given (see `get_scroll`), the diff is against
+        `previous_dump` after moving those rows, like the terminal does when
+        they are scrolled. New rows are blank.
 
-        for y in range(0, self.lines):
-            if (y + offset) in self.buffer:
-                line = self.buffer[y + offset]
+        Only the cells in `dirty` are compared. The caller should clear
+        `dirty` after calling `dump_lines`.
+        """
+        result = {}
+        columns = self.columns
+
+        if previous_dump is None or len(previous_dump) != self.lines:
+            previous_dump = None
+            spans = [ (y, 0, columns) for y in range(self.lines) ]
+        else:
+            spans = [ (y, start, min(end, columns)) for y, (start, end)
+                            in sorted(self.dirty.items()) if y < self.lines ]
+
+            if scroll:
+                top, bottom, amount = scroll
+                previous_dump = list(previous_dump)
+                region = previous_dump[top:bottom + 1]
+                blank = [ Line() for _ in range(abs(amount)) ]
+
+                if amount > 0:
+                    previous_dump[top:bottom + 1] = region[amount:] + blank
+                else:
+                    previous_dump[top:bottom + 1] = blank + region[:amount]
+
+                # All rows of the region moved, compare them completely.
+                spans = [ (y, start, end) for y, start, end in spans if not top <= y <= bottom ]
+                spans.extend((y, 0, columns) for y in range(top, bottom + 1))
+                spans.sort()
+
+        for y, start, end in spans:
+            line = self._rows[y]
+            chars = line.chars[start:end]
+            styles = line.styles[start:end]
+
+            if previous_dump:
+                previous = previous_dump[y]
+                previous_chars = previous.chars[start:end]
+                previous_styles = previous.styles[start:end]
+
+                # Compare whole spans first. That's done in C.
+                if previous_chars == chars and previous_styles == styles:
+                    continue
             else:
-                # Empty line
-                line = defaultdict(lambda: Char(data=' '))
+                previous_chars = previous_styles = None
+
+            line_diff = {}
+            length = len(chars)
+            previous_length = len(previous_chars) if previous_dump else 0
+
+            for i in range(0, end - start):
+                if i < length:
+                    c, s = chars[i], styles[i]
+                else:
+                    c, s = SPACE, 0
+
+                if i < previous_length:
+                    changed = (c != previous_chars[i] or s != previous_styles[i])
+                else:
+                    changed = (c != SPACE or s != 0 or not previous_dump)
 
-            for x in range(0, self.columns):
-                char = line.get(x, space)
-                #if not previous_dump or previous_dump[y][x] != char:
-                if not (previous_dump and chars_eq(previous_dump[y][x], char)):
-                    result[y][x] = char
+                if changed:
+                    line_diff[start + i] = (chr(c), s)
+
+            if line_diff:
+                result[y] = line_diff
 
         return result
 
+    def dump_lines(self, previous_dump=None):
+        """
+        Copy of the visible rows, to be passed to `dump_character_diff`
+        during the next repaint. When `previous_dump` is given, only the
+        dirty rows are copied, the others are taken from there.
+        """
+        columns = self.columns
+
+        if previous_dump is None or len(previous_dump) != self.lines:
+            return [ line.copy(columns) for line in self._rows ]
+        else:
+            result = list(previous_dump)
+            for y in self.dirty:
+                if y < self.lines:
+                    result[y] = self._rows[y].copy(columns)
+            return result
+
     def resize(self, lines=None, columns=None):
         # don't do anything except saving the dimensions
         self.lines = lines if lines is not None else self.lines
         self.columns = columns if columns is not None else self.columns
         self._reset_offset_and_margins()
+        self._mark_dirty()
 
     def _reset_offset_and_margins(self):
         """
-        Recalculate offset and move cursor (make sure that the bottom is
-        visible.)
+        Make the amount of visible rows match the screen size and move the
+        cursor along. (This keeps the cursor visible.)
+
+        Shrinking first drops empty rows below the cursor, then moves rows
+        from the top into the history. Growing takes them back from the
+        history first. The cost is proportional to the change in size.
         """
         self.margins = Margins(0, self.lines - 1)
+        rows = self._rows
+
+        while len(rows) > self.lines and len(rows) - 1 > self.cursor.y and not rows[-1]:
+            rows.pop()
 
-        if self.buffer:
-            new_line_offset = max(0, max(self.buffer.keys()) - self.lines + 4)
-            self.cursor.y += (self.line_offset - new_line_offset)
-            self.line_offset = new_line_offset # TODO: maybe put this in a scroll_offset function.
+        while len(rows) > self.lines:
+            self.history.append(rows.pop(0))
+            self.cursor.y -= 1
+
+        while len(rows) < self.lines and self.history:
+            rows.insert(0, self.history.pop())
+            self.cursor.y += 1
+
+        while len(rows) < self.lines:
+            rows.append(Line())
+
+        self.cursor.y = min(max(0, self.cursor.y), self.lines - 1)
 
     def set_mode(self, *modes, **kwargs):
         # Private mode codes are shifted, to be distingiushed from non
@@ -156,9 +578,7 @@ class BetterScreen(pyte.Screen):
 
         # Mark all displayed characters as reverse. # TODO !!
         if mo.DECSCNM in modes:
-            for line in self.buffer.values():
-                for pos, char in line.items():
-                    line[pos] = char._replace(reverse=True)
+            self._set_reverse(True)
 
             self.select_graphic_rendition(g._SGR["+reverse"])
 
@@ -168,9 +588,12 @@ class BetterScreen(pyte.Screen):
 
         # On "\e[?1049h", enter alternate screen mode. Backup the current state,
         if (1049 << 5) in modes:
-            self._original_screen = self.buffer
+            self._original_screen = self._rows
             self._original_screen_vars = \
                 { v:getattr(self, v) for v in self.swap_variables }
+
+            # The alternate screen doesn't have a history.
+            self.history = History(0)
             self.reset()
             self._reset_offset_and_margins()
 
@@ -192,9 +615,7 @@ class BetterScreen(pyte.Screen):
             self.cursor_position()
 
         if mo.DECSCNM in modes: # TODO verify!!
-            for line in self.buffer.values():
-                for pos, char in line.items():
-                    line[pos] = char._replace(reverse=False)
+            self._set_reverse(False)
             self.select_graphic_rendition(g._SGR["-reverse"])
 
         # Hide the cursor.
@@ -205,11 +626,30 @@ class BetterScreen(pyte.Screen):
         if (1049 << 5) in modes and self._original_screen:
             for k, v in self._original_screen_vars.items():
                 setattr(self, k, v)
-            self.buffer = self._original_screen
+            self._rows = self._original_screen
 
             self._original_screen = None
             self._original_screen_vars = {}
             self._reset_offset_and_margins()
+            self._mark_dirty()
+
+    def _set_reverse(self, reverse):
+        """
+        Set or unset the reverse attribute of all visible characters. (Lines
+        in the history are left alone; older ones are compressed.)
+        """
+        mapping = {}
+
+        def get_style(style_id):
+            if style_id not in mapping:
+                mapping[style_id] = style_table.intern(
+                        style_table[style_id]._replace(reverse=reverse))
+            return mapping[style_id]
+
+        for line in self._rows:
+            line.styles = array('I', [ get_style(s) for s in line.styles ])
+
+        self._mark_dirty()
 
     def draw(self, char):
         # Translating a given character.
@@ -233,66 +673,124 @@ class BetterScreen(pyte.Screen):
         if mo.IRM in self.mode:
             self.insert_characters(1)
 
-        self._set_char(self.cursor.x, self.cursor.y,
-                                self.cursor.attrs._replace(data=char))
+        x, y = self.cursor.x, self.cursor.y
+        self._rows[y].set(x, ord(char), self.cursor.style)
+
+        span = self.dirty.get(y)
+        if span is not FULL_ROW:
+            self._mark_cells_dirty(y, x, x + 1)
 
         # .. note:: We can't use :meth:`cursor_forward()`, because that
         #           way, we'll never know when to linefeed.
         self.cursor.x += 1
 
+    def draw_text(self, text):
+        """
+        Display a run of printable characters. This does the same as calling
+        `draw` for every character, but writes everything that fits on the
+        current line at once.
+        """
+        # Insert mode is rare, use the slow path.
+        if mo.IRM in self.mode:
+            for char in text:
+                self.draw(char)
+            return
+
+        text = text.translate([self.g0_charset,
+                               self.g1_charset][self.charset])
+        cursor = self.cursor
+
+        while text:
+            # Wrap (or stay in the last column), like `draw` does.
+            if cursor.x == self.columns:
+                if mo.DECAWM in self.mode:
+                    self.carriage_return()
+                    self.linefeed()
+                else:
+                    cursor.x -= 1
+
+            x, y = cursor.x, cursor.y
+            available = self.columns - x
+
+            if available < 0:
+                # The cursor is behind the margin after a resize. `draw` doesn't
+                # wrap in this case either.
+                chunk, text = text, ''
+            elif len(text) > available and mo.DECAWM not in self.mode:
+                # Without autowrap, all remaining characters are written in the
+                # last column. Only the last one stays visible.
+                chunk = text[:available - 1] + text[-1]
+                text = ''
+            else:
+                chunk, text = text[:available], text[available:]
+
+            self._rows[y].write(x, chunk, cursor.style)
+            cursor.x += len(chunk)
+
+            if self.dirty.get(y) is not FULL_ROW:
+                self._mark_cells_dirty(y, x, cursor.x)
+
     def _set_char(self, x, y, char):
-        self.buffer[y + self.line_offset][x] = char
+        self._rows[y].set(x, ord(char.data), style_table.intern(char))
+        self._mark_cells_dirty(y, x, x + 1)
 
     def index(self):
         """Move the cursor down one line in the same column. If the
-        cursor is at the last line, create a new line at the bottom.
+        cursor is at the bottom margin, scroll the region up.
+
+        Scrolling moves the references to the `Line` objects. Rows are
+        never copied.
         """
         top, bottom = self.margins
 
-        # When scrolling over the full screen -> keep history.
-        if top == 0 and bottom == self.lines - 1:
-            if self.cursor.y == self.lines - 1:
-                self.line_offset += 1
+        if self.cursor.y == bottom:
+            if top == 0 and bottom == self.lines - 1:
+                # When scrolling over the full screen -> keep history.
+                self.history.append(self._rows.pop(0))
+                self._rows.append(Line())
             else:
-                self.cursor_down()
-        else:
-            if self.cursor.y == bottom:
-                for line in range(top, bottom):
-                    self.buffer[line] = self.buffer[line+1]
-                    del self.buffer[line+1]
-            else:
-                self.cursor_down()
-
-    def reverse_index(self): # XXX: Used when going multiline with bash. (only second part tested.)
+                del self._rows[top]
+                self._rows.insert(bottom, Line())
+
+            self._mark_dirty(top, bottom + 1)
+        elif self.cursor.y < self.lines - 1:
+            # (Below the bottom margin, the cursor can move until the bottom
+            # of the screen.)
+            self.cursor.y += 1
+
+    def reverse_index(self):
+        """Move the cursor up one line in the same column. If the cursor
+        is at the top margin, scroll the region down. (The line at the
+        bottom margin is lost.)
+        """
         top, bottom = self.margins
 
-        # When scrolling over the full screen -> keep history.
         if self.cursor.y == top:
-            for line in range(bottom, top, -1):
-                self.buffer[line] = self.buffer[line-1]
-                del self.buffer[line-1]
-        else:
-            self.cursor_up()
+            del self._rows[bottom]
+            self._rows.insert(top, Line())
+            self._mark_dirty(top, bottom + 1)
+        elif self.cursor.y > 0:
+            self.cursor.y -= 1
 
     def insert_lines(self, count=None):
         """Inserts the indicated # of lines at line with cursor. Lines
         displayed **at** and below the cursor move down. Lines moved
         past the bottom margin are lost.
 
-        :param count: number of lines to delete.
+        :param count: number of lines to insert.
         """
         count = count or 1
         top, bottom = self.margins
+        y = self.cursor.y
 
         # If cursor is outside scrolling margins it -- do nothin'.
-        if top <= self.cursor.y <= bottom:
-            #if (bottom + self.line_offset) in self.buffer:
-            #    del self.buffer[bottom + self.line_offset]
+        if top <= y <= bottom:
+            count = min(count, bottom - y + 1)
 
-            for line in range(bottom, self.cursor.y + count - 1, -1):
-                self.buffer[line + self.line_offset] = self.buffer[line + self.line_offset - count]
-                del self.buffer[line + self.line_offset - count]
+            del self._rows[bottom - count + 1:bottom + 1]
+            self._rows[y:y] = [ Line() for _ in range(count) ]
 
+            self._mark_dirty(y, bottom + 1)
             self.carriage_return()
 
     def delete_lines(self, count=None):
@@ -305,12 +803,17 @@ class BetterScreen(pyte.Screen):
         """
         count = count or 1
         top, bottom = self.margins
+        y = self.cursor.y
 
         # If cursor is outside scrolling margins it -- do nothin'.
-        if top <= self.cursor.y <= bottom:
-            for line in range(self.cursor.y, bottom - count, -1):
-                self.buffer[line + self.line_offset] = self.buffer[line + self.line_offset + count]
-                del self.buffer[line + self.line_offset + count]
+        if top <= y <= bottom:
+            count = min(count, bottom - y + 1)
+
+            del self._rows[y:y + count]
+            self._rows[bottom - count + 1:bottom - count + 1] = [ Line() for _ in range(count) ]
+
+            self._mark_dirty(y, bottom + 1)
+            self.carriage_return()
 
     def insert_characters(self, count=None): # XXX: used by pressing space in bash vi mode
         """Inserts the indicated # of blank characters at the cursor
@@ -322,22 +825,16 @@ class BetterScreen(pyte.Screen):
         """
         count = count or 1
 
-        line = self.buffer[self.cursor.y + self.line_offset]
-        max_columns = max(line.keys())
-
-        for i in range(max_columns, self.cursor.x, -1):
-            line[i + count] = line[i]
-            del line[i]
+        line = self._rows[self.cursor.y]
+        line.insert(self.cursor.x, count, width=self.columns)
+        self._mark_cells_dirty(self.cursor.y, self.cursor.x, self.columns)
 
     def delete_characters(self, count=None): # XXX: used by pressing 'x' on bash vi mode
         count = count or 1
 
-        line = self.buffer[self.cursor.y + self.line_offset]
-        max_columns = max(line.keys())
-
-        for i in range(self.cursor.x, max_columns):
-            line[i] = line[i + count]
-            del line[i + count]
+        line = self._rows[self.cursor.y]
+        line.delete(self.cursor.x, count)
+        self._mark_cells_dirty(self.cursor.y, self.cursor.x, self.columns)
 
     def erase_characters(self, count=None):
         raise NotImplementedError('erase_characters not implemented') # TODO
@@ -355,18 +852,17 @@ class BetterScreen(pyte.Screen):
         :param bool private: when ``True`` character attributes aren left
                              unchanged **not implemented**.
         """
-        def should_we_delete(column): # TODO: check for off-by-one errors!
-           if type_of == 0:
-                return column >= self.cursor.x
-           if type_of == 1:
-                return column <= self.cursor.x
-           if type_of == 2:
-                return True
-
-        line = self.buffer[self.cursor.y + self.line_offset]
-        for column in list(line.keys()):
-           if should_we_delete(column):
-               del line[column]
+        line = self._rows[self.cursor.y]
+
+        if type_of == 0:
+            line.erase(self.cursor.x)
+            self._mark_cells_dirty(self.cursor.y, self.cursor.x, self.columns)
+        elif type_of == 1:
+            line.erase(0, self.cursor.x + 1)
+            self._mark_cells_dirty(self.cursor.y, 0, self.cursor.x + 1)
+        elif type_of == 2:
+            line.erase()
+            self._mark_dirty(self.cursor.y, self.cursor.y + 1)
 
     def erase_in_display(self, type_of=0, private=False):
         """Erases display in a specific way.
@@ -394,7 +890,8 @@ class BetterScreen(pyte.Screen):
         )[type_of]
 
         for line in interval: # TODO: from where the -1 in the index below??
-            self.buffer[line + self.line_offset] = defaultdict(lambda: Char(data=' '))
+            self._rows[line] = Line()
+            self._mark_dirty(line, line + 1)
 
         # In case of 0 or 1 we have to erase the line with the cursor.
         if type_of in [0, 1]:
@@ -402,46 +899,12 @@ class BetterScreen(pyte.Screen):
 
     def alignment_display(self):
         for y in range(0, self.lines):
-            line = self.buffer[y + self.line_offset]
-            for x in range(0, self.columns):
-                line[x] = Char('E')
+            self._rows[y] = Line(
+                    array('I', [ord('E')]) * self.columns, _BLANK_STYLES * self.columns)
+        self._mark_dirty()
 
     def select_graphic_rendition(self, *attrs):
-        """ Support 256 colours """
-        g = pyte.graphics
-        replace = {}
-
-        if not attrs:
-            attrs = [0]
-        else:
-            attrs = list(attrs[::-1])
-
-        while attrs:
-            attr = attrs.pop()
-
-            if attr in g.FG:
-                replace["fg"] = g.FG[attr]
-            elif attr in g.BG:
-                replace["bg"] = g.BG[attr]
-            elif attr in g.TEXT:
-                attr = g.TEXT[attr]
-                replace[attr[1:]] = attr.startswith("+")
-            elif not attr:
-                replace = self.default_char._asdict()
-
-            elif attr in (38, 48):
-                n = attrs.pop()
-                if n != 5:
-                    continue
-
-                if attr == 38:
-                    m = attrs.pop()
-                    replace["fg"] = 1024 + m
-                elif attr == 48:
-                    m = attrs.pop()
-                    replace["bg"] = 1024 + m
-
-        self.cursor.attrs = self.cursor.attrs._replace(**replace)
+        """ Support 256 colours and true colour. """
+        self.cursor.style = apply_sgr(self.cursor.style, attrs)
 
         # See tmux/input.c, line: 1388
-
@@ -0,0 +1,147 @@
+"""
+Searching the scrollback.
+
+Compressed blocks of the history carry a trigram bitmap of their
+(case folded) text. A query knows which trigrams a matching line has to
+contain, so that blocks that can't contain a match are skipped without
+decompressing them. Only the candidate blocks are searched line by line.
+"""
+import re
+
+try:
+    from re import _parser as sre_parse # Python 3.11+, where sre_parse is deprecated.
+except ImportError:
+    import sre_parse
+
+__all__ = ('SearchQuery', 'SearchMatch', 'trigram_bitmap')
+
+
+#: Amount of bits in the trigram bitmap of a block.
+TRIGRAM_BITS = 1 << 15
+
+_MASK = TRIGRAM_BITS - 1
+
+
+def _trigram_positions(text):
+    """ Set of bitmap positions for the trigrams in this (case folded) text. """
+    return { hash(t) & _MASK for t in set(zip(text, text[1:], text[2:])) }
+
+
+def trigram_bitmap(texts):
+    """
+    Create the bitmap for these lines of text. A bit is set for every
+    trigram that appears in one of the lines.
+    """
+    bitmap = bytearray(TRIGRAM_BITS // 8)
+
+    for p in _trigram_positions('\n'.join(texts).casefold()):
+        bitmap[p >> 3] |= 1 << (p & 7)
+
+    return bytes(bitmap)
+
+
+def _required_literals(pattern):
+    """
+    Return the literal strings that appear in every match of this regular
+    expression. (Only the top level of the pattern is considered, anything
+    that's optional, repeated or an alternative is skipped.)
+    """
+    result = []
+    current = []
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return result
+
+    for op, value in parsed:
+        if op == sre_parse.LITERAL:
+            current.append(chr(value))
+        else:
+            result.append(''.join(current))
+            current = []
+
+    result.append(''.join(current))
+    return [ l for l in result if len(l) >= 3 ]
+
+
+class SearchMatch:
+    """
+    A match in the screen buffer.
+
+    :param line: Absolute line index. (History lines first, then the
+                 visible rows, like `BetterScreen.get_line`.)
+    :param start: Column where the match starts.
+    :param end: Column after the match.
+    """
+    __slots__ = ('line', 'start', 'end')
+
+    def __init__(self, line, start, end):
+        self.line = line
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return 'SearchMatch(line=%r, start=%r, end=%r)' % (self.line, self.start, self.end)
+
+    def __eq__(self, other):
+        return (isinstance(other, SearchMatch) and
+                (self.line, self.start, self.end) == (other.line, other.start, other.end))
+
+
+class SearchQuery:
+    """
+    Compiled search.
+
+    :param pattern: The text to search for.
+    :param regex: When True, `pattern` is a regular expression.
+    :param ignore_case: Case insensitive search.
+    """
+    def __init__(self, pattern, regex=False, ignore_case=False):
+        self.pattern = pattern
+        self.regex = regex
+        self.ignore_case = ignore_case
+
+        if regex:
+            literals = _required_literals(pattern)
+        else:
+            literals = [pattern] if len(pattern) >= 3 else []
+            pattern = re.escape(pattern)
+
+        self._re = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+        # Bitmap positions that have to be set in a block that contains a match.
+        self._positions = set()
+        for l in literals:
+            self._positions |= _trigram_positions(l.casefold())
+
+    def may_match(self, bitmap):
+        """ False when a block with this trigram bitmap can't contain a match. """
+        for p in self._positions:
+            if not bitmap[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def search_line(self, text, start=0, end=None, backwards=False):
+        """
+        Return (start, end) of the first match in this line of text, or the
+        last match when `backwards` is set. Only matches that start in the
+        range [start, end) are considered. Returns None if nothing was found.
+        """
+        if end is None:
+            end = len(text)
+
+        if backwards:
+            result = None
+            pos = start
+            while pos < end:
+                m = self._re.search(text, pos)
+                if not m or m.start() >= end:
+                    break
+                result = m.span()
+                pos = m.start() + 1
+            return result
+        else:
+            m = self._re.search(text, start)
+            if m and m.start() < end:
+                return m.span()
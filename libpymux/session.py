@@ -1,12 +1,12 @@
+from .history import DEFAULT_HISTORY_LIMIT, DEFAULT_COLD_THRESHOLD
 from .invalidate import Redraw
 from .layout import Location
 from .log import logger
+from .panes import DEFAULT_READ_DRAIN
 from .statusbar import StatusBar
 from .window import Window
 
-from collections import defaultdict
-from pyte.screens import Char
-
+from collections import OrderedDict
 import asyncio
 import weakref
 
@@ -15,6 +15,13 @@ loop = asyncio.get_event_loop()
 
 MAX_WORKERS = 1024 # Max number of threads for the pane runners.
 
+#: Default maximum amount of repaints per second.
+DEFAULT_MAX_FPS = 30
+
+#: Default amount of seconds after a keystroke during which output is painted
+#: right away, without waiting for the next frame. (For the echo.)
+DEFAULT_INTERACTIVE_TIMEOUT = .1
+
 
 class Session:
     """
@@ -26,11 +33,37 @@ class Session:
         self.windows = [ ]
         self.active_window = None
 
-        self._last_char_buffers = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: Char)))
+        # Scrollback options for new panes in this session.
+        self.history_limit = DEFAULT_HISTORY_LIMIT
+        self.history_cold_threshold = DEFAULT_COLD_THRESHOLD
+        self.history_spill = False
+
+        # Maximum amount of reads from the pseudo terminal of a pane, before
+        # the pane is invalidated.
+        self.read_drain = DEFAULT_READ_DRAIN
+
+        # `WorkerPool` that parses the output of new panes, or None to parse
+        # in this process.
+        self.worker_pool = None
 
         self._invalidated = False
         self._invalidate_parts = 0
 
+        # Repaint scheduling. While a pane floods output, only the screens
+        # are updated, and at most `max_fps` frames per second are rendered.
+        self.max_fps = DEFAULT_MAX_FPS
+        self.interactive_timeout = DEFAULT_INTERACTIVE_TIMEOUT
+        self._last_repaint_time = 0
+        self._last_input_time = 0
+
+        # Statistics: rendered frames, invalidations that were merged in a
+        # pending repaint, and invalidations that were merged because of
+        # the frame rate cap. (Without the cap, these would have been frames.)
+        self.frames_rendered = 0
+        self.frames_coalesced = 0
+        self.frames_skipped = 0
+        self._repaint_delayed = False
+
         self.status_bar = StatusBar(weakref.ref(self))
 
         self.invalidate()
@@ -39,38 +72,115 @@ class Session:
         """ Schedule repaint. """
         self._invalidate_parts |= invalidate_parts
 
-        if not self._invalidated:
-            logger.info('Scheduling repaint: %r' % self._invalidate_parts)
+        if self._invalidated:
+            if self._repaint_delayed:
+                self.frames_skipped += 1
+            else:
+                self.frames_coalesced += 1
+        else:
             self._invalidated = True
-            loop.call_soon(lambda: asyncio.async(self.repaint()))
+            now = loop.time()
+
+            if now - self._last_input_time < self.interactive_timeout:
+                delay = 0
+            else:
+                delay = self._last_repaint_time + 1. / self.max_fps - now
+
+            if delay > 0:
+                self._repaint_delayed = True
+                loop.call_later(delay, self._start_repaint)
+            else:
+                loop.call_soon(self._start_repaint)
+
+    def _start_repaint(self):
+        logger.info('Repaint: %r' % self._invalidate_parts)
+        self._repaint_delayed = False
+        self._last_repaint_time = loop.time()
+        self.frames_rendered += 1
+        self.repaint()
 
     def repaint(self):
+        """
+        Render the changes and queue them for every renderer. This doesn't
+        wait for the output to be written, slow clients don't delay the
+        others.
+        """
         parts = self._invalidate_parts
+        panes = self.active_window.panes if self.active_window else []
 
-        if not self.active_window:
-            char_diffs = { }
-        else:
-            # Dump diffs for visible panes
-            def get_previous_dump(pane):
-                if self._invalidate_parts & Redraw.ClearFirst:
-                    return None
-                else:
-                    return self._last_char_buffers[pane]
+        # Diffs of the panes against a shadow, and against nothing. Every
+        # renderer has seen all frames since it got a shadow, so all shadows
+        # of a pane are the same dump, and the diffs can be shared. (Maps
+        # (pane, scroll) to the diff against the shadow after scrolling.)
+        diffs = {}
+        full_diffs = {}
+        previous_dumps = {}
+        pane_scrolls = {}
 
-            char_diffs = {
-                pane:pane.screen.dump_character_diff(get_previous_dump(pane))
-                for pane in self.active_window.panes }
+        # Renderers with the same frame key (and so the same size) get the
+        # same output: it's rendered once, for the first of them.
+        groups = OrderedDict()
+
+        for r in self.renderers:
+            # Skip clients that are catching up after frames were dropped.
+            # They get a full repaint later.
+            if r.behind:
+                continue
+
+            renderer_parts = parts if r.shadow is not None else parts | Redraw.All
+            shadow = {} if renderer_parts & Redraw.ClearFirst else r.shadow
+            char_diffs = {}
+            scrolls = {}
+
+            for pane in panes:
+                previous_dump = shadow.get(pane)
+
+                if previous_dump is None:
+                    if pane not in full_diffs:
+                        full_diffs[pane] = pane.screen.dump_character_diff(None)
+                    char_diffs[pane] = full_diffs[pane]
+                else:
+                    previous_dumps[pane] = previous_dump
+                    scroll = None
+
+                    # Rows that moved are scrolled by the terminal, when it can.
+                    if r.can_scroll(pane):
+                        if pane not in pane_scrolls:
+                            pane_scrolls[pane] = pane.screen.get_scroll(previous_dump)
+                        scroll = pane_scrolls[pane]
+
+                    if (pane, scroll) not in diffs:
+                        diffs[pane, scroll] = pane.screen.dump_character_diff(previous_dump, scroll)
+                    char_diffs[pane] = diffs[pane, scroll]
+
+                    if scroll:
+                        scrolls[pane] = scroll
+
+            key = r.get_frame_key(renderer_parts)
+            if key in groups:
+                groups[key][3].append(r)
+            else:
+                groups[key] = (renderer_parts, char_diffs, scrolls, [r])
+
+        # Take a copy of the rows right now, the screens can change during the
+        # repaint. After that, the dirty rows have been handled. (Rows that
+        # didn't change are shared with the previous dump.)
+        dumps = {}
+        for pane in panes:
+            dumps[pane] = pane.screen.dump_lines(previous_dumps.get(pane))
+            pane.screen.dirty.clear()
 
         self._invalidate_parts = 0
 
-        for r in self.renderers:
-            yield from r.repaint(parts, char_diffs)
+        for renderer_parts, char_diffs, scrolls, renderers in groups.values():
+            data = renderers[0].render(renderer_parts, char_diffs, scrolls)
 
-        # Apply diffs
-        for pane, diff in char_diffs.items():
-            for y, line_data in diff.items():
-                for x, char in line_data.items():
-                    self._last_char_buffers[pane][y][x] = char
+            for r in renderers:
+                # Remember what has been rendered. (Unless the frame was
+                # dropped, then the next repaint of this renderer is a full
+                # one.)
+                if r.write_frame(data):
+                    r.shadow = dict(dumps)
 
         # Reschedule again, if something changed while rendering in the
         # meantime.
@@ -78,6 +188,16 @@ class Session:
         if self._invalidate_parts:
             self.invalidate(self._invalidate_parts)
 
+    def get_pane_options(self):
+        """ Keyword arguments for creating a new pane in this session. """
+        return {
+            'history_limit': self.history_limit,
+            'history_cold_threshold': self.history_cold_threshold,
+            'history_spill': self.history_spill,
+            'worker_pool': self.worker_pool,
+            'read_drain': self.read_drain,
+        }
+
     def add_renderer(self, renderer):
         """ Add this session renderer. """
         self.renderers.append(renderer)
@@ -136,7 +256,21 @@ class Session:
 
     # Commands
 
+    def get_repaint_stats(self):
+        return {
+            'max_fps': self.max_fps,
+            'frames_rendered': self.frames_rendered,
+            'frames_coalesced': self.frames_coalesced,
+            'frames_skipped': self.frames_skipped,
+        }
+
+    def get_output_stats(self):
+        """ Output queue statistics of every renderer. """
+        return [ r.get_output_stats() for r in self.renderers ]
+
     def send_input_to_current_pane(self, data):
+        self._last_input_time = loop.time()
+
         if self.active_pane:
             logger.info('Sending %r' % b''.join(data))
             self.active_pane.write_input(b''.join(data))
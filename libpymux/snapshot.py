@@ -0,0 +1,466 @@
+"""
+Binary snapshots of screens and sessions.
+
+A snapshot contains everything that's needed to show the panes again: the
+layout of the windows, and for every screen the visible rows, the history,
+cursor, margins, modes, charsets, tab stops and the backup of the main screen
+while the alternate screen is active. It's used for fast reattaching and to
+restore the panes after a restart or crash of the server. (The processes that
+were running in the panes can't be restored.)
+
+The format::
+
+    header:  magic, version, byte order
+    session: amount of windows, index of the active window, windows
+    window:  amount of panes, index of the active pane, layout tree, panes
+    pane:    size, screen
+    screen:  new styles, size, state, history, rows, [alternate screen backup]
+
+Integers are unsigned 32 bit little endian. Lines are written in compressed
+chunks of up to `BLOCK_SIZE` rows, like the cold blocks of the `History`,
+which are copied as they are. (These chunks contain native arrays, so a
+snapshot can only be loaded on a machine with the same byte order.)
+
+`dump_screen` and `dump_session` are generators that yield the snapshot in
+chunks of bytes. `load_screen` and `load_session` take a `read(size)`
+callable, like the `read` method of a file.
+"""
+from array import array
+from pyte import charsets as cs
+from pyte.screens import Margins
+import asyncio
+import struct
+import sys
+import weakref
+
+from .history import History, BLOCK_SIZE, _encode_block, _decode_block
+from .layout import TileContainer, HSplit, VSplit
+from .screen import BetterScreen, BetterCursor
+from .styles import style_table, DEFAULT_STYLE
+from .window import Window
+
+__all__ = (
+    'SnapshotError',
+    'SNAPSHOT_VERSION',
+    'dump_screen',
+    'load_screen',
+    'dump_session',
+    'load_session',
+    'write_session_snapshot',
+)
+
+
+MAGIC = b'PYMUXSNP'
+
+#: Version of the snapshot format. Incremented for every incompatible change.
+SNAPSHOT_VERSION = 1
+
+_BYTE_ORDER = { 'little': 0, 'big': 1 }[sys.byteorder]
+
+# Node types in the layout tree.
+_PANE_NODE, _TILE_NODE, _HSPLIT_NODE, _VSPLIT_NODE = range(4)
+
+_LAYOUT_CLASSES = {
+    _TILE_NODE: TileContainer,
+    _HSPLIT_NODE: HSplit,
+    _VSPLIT_NODE: VSplit,
+}
+
+# Flags for the boolean attributes of a style.
+_STYLE_FLAGS = ('bold', 'italics', 'underscore', 'strikethrough', 'reverse')
+
+
+class SnapshotError(Exception):
+    """ The data is not a (compatible) snapshot. """
+
+
+class _Writer:
+    """ Collects the encoded values until `flush` is called. """
+    def __init__(self):
+        self._parts = []
+
+    def uint(self, *values):
+        self._parts.append(struct.pack('<%iI' % len(values), *values))
+
+    def uints(self, values):
+        """ Sequence of integers, prefixed by the length. """
+        values = list(values)
+        self.uint(len(values), *values)
+
+    def bytes(self, data):
+        self.uint(len(data))
+        self._parts.append(data)
+
+    def string(self, text):
+        self.bytes(text.encode('utf-8'))
+
+    def flush(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+class _Reader:
+    def __init__(self, read):
+        self._read = read
+
+    def _read_exactly(self, size):
+        data = self._read(size)
+        if len(data) != size:
+            raise SnapshotError('Snapshot is truncated.')
+        return data
+
+    def uint(self, count=1):
+        values = struct.unpack('<%iI' % count, self._read_exactly(4 * count))
+        return values[0] if count == 1 else values
+
+    def uints(self):
+        count = self.uint()
+        return struct.unpack('<%iI' % count, self._read_exactly(4 * count))
+
+    def bytes(self):
+        return self._read_exactly(self.uint())
+
+    def string(self):
+        return self.bytes().decode('utf-8')
+
+
+class _StyleMapping:
+    """
+    Style IDs of the process that wrote a snapshot are written as they are.
+    The style definitions are written incrementally, before every screen,
+    and mapped to the IDs of the `style_table` while loading.
+    """
+    def __init__(self):
+        self.count = 0
+        self.ids = []
+
+    def write(self, w):
+        """ Write the styles that were interned after the last call. """
+        end = len(style_table)
+        w.uint(end - self.count)
+
+        for style_id in range(self.count, end):
+            style = style_table[style_id]
+
+            for colour in (style.fg, style.bg):
+                if isinstance(colour, int):
+                    w.uint(1, colour)
+                else:
+                    w.uint(0)
+                    w.string(colour)
+
+            w.uint(sum(1 << i for i, name in enumerate(_STYLE_FLAGS) if getattr(style, name)))
+
+        self.count = end
+
+    def read(self, r):
+        for _ in range(r.uint()):
+            colours = []
+            for _ in range(2):
+                colours.append(r.uint() if r.uint() else r.string())
+
+            flags = r.uint()
+            attrs = { name: bool(flags & (1 << i)) for i, name in enumerate(_STYLE_FLAGS) }
+
+            # (Not `Char(...)`: pyte swaps its `reverse` and `strikethrough`
+            # arguments.)
+            attrs = DEFAULT_STYLE._replace(fg=colours[0], bg=colours[1], **attrs)
+            self.ids.append(style_table.intern(attrs))
+
+    @property
+    def identity(self):
+        """ True when the IDs don't have to be translated. """
+        return all(i == s for i, s in enumerate(self.ids))
+
+    def translate(self, lines):
+        if not self.identity:
+            ids = self.ids
+            for line in lines:
+                line.styles = array('I', [ ids[s] for s in line.styles ])
+        return lines
+
+
+def _charset_code(charset):
+    for code, value in cs.MAPS.items():
+        if value == charset:
+            return code
+    return 'U'
+
+
+def _write_lines(w, lines):
+    """ Yield chunks of bytes for these lines. """
+    w.uint(len(lines))
+
+    for i in range(0, len(lines), BLOCK_SIZE):
+        w.bytes(_encode_block(lines[i:i + BLOCK_SIZE]))
+        yield w.flush()
+
+
+def _read_lines(r, styles):
+    lines = []
+    count = r.uint()
+
+    while len(lines) < count:
+        lines.extend(styles.translate(_decode_block(r.bytes())))
+    return lines
+
+
+def _capture_state(variables, rows):
+    """
+    Take a copy of the screen state, so that the screen can change while the
+    snapshot is being written.
+    """
+    history = variables['history']
+    cursor = variables['cursor']
+
+    return {
+        'mode': sorted(variables['mode']),
+        'margins': variables['margins'],
+        'charset': variables['charset'],
+        'g0_charset': _charset_code(variables['g0_charset']),
+        'g1_charset': _charset_code(variables['g1_charset']),
+        'tabstops': sorted(variables['tabstops']),
+        'cursor': (cursor.x, cursor.y, getattr(cursor, 'style', 0), cursor.hidden),
+        'history': (history.limit, history.cold_threshold, history.spill) + history.get_state(),
+        'rows': [ l.copy() for l in rows ],
+    }
+
+
+def _write_state(w, state):
+    w.uints(state['mode'])
+    w.uint(state['margins'].top, state['margins'].bottom, state['charset'])
+    w.string(state['g0_charset'] + state['g1_charset'])
+    w.uints(state['tabstops'])
+
+    x, y, style, hidden = state['cursor']
+    w.uint(x, y, style, int(hidden))
+
+    limit, cold_threshold, spill, skip, blocks, lines = state['history']
+    w.uint(limit, cold_threshold, int(spill), skip, len(blocks))
+
+    for data in blocks:
+        w.bytes(data)
+        yield w.flush()
+
+    yield from _write_lines(w, lines)
+    yield from _write_lines(w, state['rows'])
+
+
+def _read_state(r, styles):
+    """ Return a dict with the values for `BetterScreen.swap_variables`, and the rows. """
+    result = {}
+    result['mode'] = set(r.uints())
+
+    top, bottom, charset = r.uint(3)
+    result['margins'] = Margins(top, bottom)
+    result['charset'] = charset
+
+    g0, g1 = r.string()
+    result['g0_charset'] = cs.MAPS[g0]
+    result['g1_charset'] = cs.MAPS[g1]
+    result['tabstops'] = set(r.uints())
+
+    x, y, style, hidden = r.uint(4)
+    cursor = BetterCursor(x, y, styles.ids[style])
+    cursor.hidden = bool(hidden)
+    result['cursor'] = cursor
+
+    limit, cold_threshold, spill, skip, block_count = r.uint(5)
+    blocks = [ r.bytes() for _ in range(block_count) ]
+
+    if not styles.identity:
+        blocks = [ _encode_block(styles.translate(_decode_block(data))) for data in blocks ]
+
+    history = History(limit, cold_threshold=cold_threshold, spill=bool(spill))
+    history.set_state(skip, blocks, _read_lines(r, styles))
+    result['history'] = history
+
+    return result, _read_lines(r, styles)
+
+
+def _dump_screen(w, screen, styles):
+    """ Yield chunks of bytes for this screen. """
+    # Take a copy of everything first.
+    state = _capture_state({ v: getattr(screen, v) for v in screen.swap_variables }, screen._rows)
+
+    original_screen = getattr(screen, '_original_screen', None)
+    if original_screen:
+        original_state = _capture_state(screen._original_screen_vars, original_screen)
+    else:
+        original_state = None
+
+    styles.write(w)
+    w.uint(screen.lines, screen.columns)
+    yield from _write_state(w, state)
+
+    w.uint(int(original_state is not None))
+    if original_state:
+        yield from _write_state(w, original_state)
+
+    yield w.flush()
+
+
+def _load_screen(r, screen, styles):
+    styles.read(r)
+    screen.lines, screen.columns = r.uint(2)
+
+    variables, screen._rows = _read_state(r, styles)
+    for k, v in variables.items():
+        setattr(screen, k, v)
+
+    if r.uint():
+        screen._original_screen_vars, screen._original_screen = _read_state(r, styles)
+    else:
+        screen._original_screen = None
+        screen._original_screen_vars = {}
+
+    screen.dirty = {}
+    screen._mark_dirty()
+    return screen
+
+
+def _write_header(w):
+    w._parts.append(MAGIC)
+    w.uint(SNAPSHOT_VERSION, _BYTE_ORDER)
+
+
+def _read_header(r):
+    if r._read_exactly(len(MAGIC)) != MAGIC:
+        raise SnapshotError('Not a snapshot.')
+
+    version, byte_order = r.uint(2)
+
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError('Unsupported snapshot version: %r' % version)
+
+    if byte_order != _BYTE_ORDER:
+        raise SnapshotError('Snapshot was written on a machine with another byte order.')
+
+
+def dump_screen(screen):
+    """ Yield a snapshot of this `BetterScreen` in chunks of bytes. """
+    w = _Writer()
+    _write_header(w)
+    yield from _dump_screen(w, screen, _StyleMapping())
+
+
+def load_screen(read, screen=None):
+    """
+    Load a screen snapshot. When `screen` is given, its contents are replaced,
+    otherwise a new `BetterScreen` is created.
+    """
+    r = _Reader(read)
+    _read_header(r)
+
+    if screen is None:
+        screen = BetterScreen(1, 1)
+
+    return _load_screen(r, screen, _StyleMapping())
+
+
+def _write_layout(w, container, panes):
+    if container in panes:
+        w.uint(_PANE_NODE, panes.index(container))
+    else:
+        node_type = { HSplit: _HSPLIT_NODE, VSplit: _VSPLIT_NODE }.get(type(container), _TILE_NODE)
+        w.uint(node_type)
+        w.uints(getattr(container, 'sizes', []))
+        w.uint(len(container.children))
+
+        for c in container.children:
+            _write_layout(w, c, panes)
+
+
+def _read_layout(r, panes):
+    node_type = r.uint()
+
+    if node_type == _PANE_NODE:
+        return panes[r.uint()]
+    else:
+        container = _LAYOUT_CLASSES[node_type]()
+        container.sizes = list(r.uints())
+
+        for _ in range(r.uint()):
+            child = _read_layout(r, panes)
+            container.children.append(child)
+            child._get_parent = weakref.ref(container)
+
+        return container
+
+
+def dump_session(session):
+    """
+    Yield a snapshot of the windows of this session and the screens of their
+    panes in chunks of bytes.
+    """
+    w = _Writer()
+    styles = _StyleMapping()
+
+    _write_header(w)
+
+    windows = list(session.windows)
+    w.uint(len(windows), windows.index(session.active_window) if session.active_window in windows else 0)
+
+    for window in windows:
+        panes = list(window.panes)
+        w.uint(len(panes), panes.index(window.active_pane) if window.active_pane in panes else 0)
+        _write_layout(w, window.layout, panes)
+
+        for pane in panes:
+            w.uint(pane.sx, pane.sy)
+            yield from _dump_screen(w, pane.screen, styles)
+
+    yield w.flush()
+
+
+def load_session(read, session, pane_factory):
+    """
+    Load a session snapshot, and add the windows to this session.
+
+    :param pane_factory: Callable that returns a new `Pane`. The screen of
+        that pane will receive the contents from the snapshot.
+    """
+    r = _Reader(read)
+    styles = _StyleMapping()
+    windows = []
+
+    _read_header(r)
+    window_count, active_window = r.uint(2)
+
+    for _ in range(window_count):
+        window = Window()
+        pane_count, active_pane = r.uint(2)
+
+        panes = [ pane_factory() for _ in range(pane_count) ]
+        window.layout = _read_layout(r, panes)
+
+        for pane in panes:
+            pane.sx, pane.sy = r.uint(2)
+            _load_screen(r, pane.screen, styles)
+
+            pane.window = weakref.ref(window)
+            window.panes.append(pane)
+
+        window.active_pane = panes[active_pane] if panes else None
+        windows.append(window)
+
+    for window in windows:
+        session.add_window(window)
+
+    if windows:
+        session.active_window = windows[active_window]
+        session.update_size()
+
+    return windows
+
+
+@asyncio.coroutine
+def write_session_snapshot(session, fileobj):
+    """
+    Write a snapshot of this session to a file object. Control is given back
+    to the event loop after every chunk, so that the panes keep running.
+    """
+    for data in dump_session(session):
+        fileobj.write(data)
+        yield from asyncio.sleep(0)
@@ -0,0 +1,204 @@
+"""
+Custom `Stream` class for the `pyte` library.
+"""
+import pyte
+import re
+
+__all__ = ('BetterStream', )
+
+
+class BetterStream(pyte.Stream):
+    """
+    `pyte.Stream` that recognises complete tokens with one compiled regular
+    expression, instead of feeding every character through the state machine:
+
+        - Runs of printable characters are passed to the screen at once, by
+          dispatching a ``draw_text`` event instead of a ``draw`` event for
+          every single character.
+        - Control characters, and complete escape and CSI sequences in their
+          usual form are dispatched directly.
+
+    Everything else (unusual sequences, sequences that are split over two
+    `feed` calls, ...) is still handled by the state machine of `pyte.Stream`,
+    one character at a time. The events, including the way errors in the
+    handlers are handled, are the same as with `pyte.Stream`. When not every
+    listener implements ``draw_text``, this behaves exactly like the original.
+    """
+    _token = re.compile(
+        # Everything except C0 control characters, DEL and the 8-bit CSI.
+        '(?P<text>[^\x00-\x1f\x7f\x9b]+)|'
+
+        # Control characters that don't take arguments.
+        '(?P<control>[\x07-\x0f])|'
+
+        # CSI sequence, like "ESC [ ? 1 ; 2 h".
+        '(?:\x1b\\[|\x9b)(?P<private>\\?)?(?P<params>[0-9;]*)(?P<csi>[\x40-\x7e])|'
+
+        # "ESC ( B", "ESC # 8" and "ESC c".
+        '\x1b(?P<mode>[()])(?P<charset>.)|'
+        '\x1b#(?P<sharp>.)|'
+        '\x1b(?P<escape>[^\\[#()])', re.DOTALL)
+
+    def __init__(self):
+        super().__init__()
+
+        # Maps event names to a list of (before, handler, after) callables.
+        self._handler_cache = {}
+
+    def attach(self, screen, only=()):
+        super().attach(screen, only)
+        self._handler_cache = {}
+
+    def detach(self, screen):
+        super().detach(screen)
+        self._handler_cache = {}
+
+    def _get_handlers(self, event):
+        result = []
+
+        for listener, only in self.listeners:
+            if only and event not in only:
+                continue
+
+            try:
+                handler = getattr(listener, event)
+            except AttributeError:
+                continue
+
+            result.append((getattr(listener, '__before__', None), handler,
+                           getattr(listener, '__after__', None)))
+        return result
+
+    def dispatch(self, event, *args, **kwargs):
+        """
+        Like `pyte.Stream.dispatch`, but the handlers of the listeners are
+        looked up only once per event.
+        """
+        try:
+            handlers = self._handler_cache[event]
+        except KeyError:
+            handlers = self._handler_cache[event] = self._get_handlers(event)
+
+        flags = self.flags
+
+        for before, handler, after in handlers:
+            if before:
+                before(event)
+
+            handler(*args, **flags)
+
+            if after:
+                after(event)
+
+        if kwargs.get("reset", True):
+            self.reset()
+
+    def feed(self, chars):
+        if not isinstance(chars, str):
+            raise TypeError("%s requires str input" % self.__class__.__name__)
+
+        if not self._can_draw_text():
+            return super().feed(chars)
+
+        match = self._token.match
+        consume = self.consume
+        dispatch = self.dispatch
+        basic = self.basic
+        i = 0
+        length = len(chars)
+
+        while i < length:
+            if self.state == 'stream':
+                m = match(chars, i)
+
+                if m:
+                    kind = m.lastgroup
+
+                    if kind == 'text':
+                        dispatch('draw_text', m.group())
+
+                    elif kind == 'control':
+                        char = m.group()
+                        self._dispatch_sequence(basic[char], unhandled=char)
+
+                    elif kind == 'csi':
+                        if not self._csi(m):
+                            consume(chars[i])
+                            i += 1
+                            continue
+
+                    elif kind == 'escape':
+                        char = m.group('escape')
+                        if char not in self.escape:
+                            consume(chars[i])
+                            i += 1
+                            continue
+                        self._dispatch_sequence(self.escape[char], state='escape', unhandled=char)
+
+                    elif kind == 'sharp':
+                        char = m.group('sharp')
+                        if char not in self.sharp:
+                            consume(chars[i])
+                            i += 1
+                            continue
+                        self._dispatch_sequence(self.sharp[char], state='sharp', unhandled=char)
+
+                    else:
+                        char = m.group('charset')
+                        self.flags['mode'] = m.group('mode')
+                        self._dispatch_sequence('set_charset', (char, ), state='charset',
+                                                unhandled=char)
+
+                    i = m.end()
+                    continue
+
+            consume(chars[i])
+            i += 1
+
+    def _csi(self, m):
+        """
+        Dispatch a CSI sequence. Returns False when this command is unknown,
+        then it's left to the state machine.
+        """
+        final = m.group('csi')
+        if final not in self.csi:
+            return False
+
+        raw_params = m.group('params').split(';')
+        params = [ min(int(p or 0), 9999) for p in raw_params ]
+
+        if m.group('private'):
+            self.flags['private'] = True
+
+        self._dispatch_sequence(self.csi[final], params, state='arguments',
+                                unhandled=final, current=raw_params[-1])
+        return True
+
+    def _dispatch_sequence(self, event, params=(), state='stream', unhandled=None, current=''):
+        """
+        Dispatch an event, and handle errors like `pyte.Stream.consume` would
+        have done at the end of this sequence: a `TypeError` leaves the state
+        machine in the state of the last character, a `KeyError` is reported
+        as a ``debug`` event.
+        """
+        try:
+            self.dispatch(event, *params)
+        except TypeError:
+            self.state = state
+            self.params = list(params)
+            self.current = current
+        except KeyError:
+            if __debug__:
+                self.state = state
+                self.params = list(params)
+                self.flags["state"] = state
+                self.flags["unhandled"] = unhandled
+                self.dispatch("debug", *self.params)
+                self.reset()
+            else:
+                raise
+
+    def _can_draw_text(self):
+        """ True when all listeners accept ``draw_text`` events. """
+        return all(hasattr(listener, 'draw_text') and (not only or 'draw_text' in only)
+                   for listener, only in self.listeners)
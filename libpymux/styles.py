@@ -0,0 +1,62 @@
+"""
+Interning of character attributes.
+
+Screen rows don't store a `Char` namedtuple for every cell. Instead, the
+attributes (colours, bold, underscore, ...) are interned in a `StyleTable`
+and every cell only stores the small integer that identifies its style.
+"""
+from pyte.screens import Char
+
+
+#: The attributes of a blank cell. This style has always ID 0.
+DEFAULT_STYLE = Char(data=' ')
+
+#: Colours are either names from `pyte.graphics` (like 'red') or integers:
+#: `COLOUR_256 + n` for the xterm 256 colour palette, and
+#: `TRUECOLOUR | 0xRRGGBB` for 24 bit colours.
+COLOUR_256 = 1024
+TRUECOLOUR = 1 << 24
+
+
+class StyleTable:
+    """
+    Bidirectional mapping between character attributes and style IDs.
+
+    Styles are never removed from the table, the amount of distinct styles
+    that applications use is very small in practice.
+    """
+    def __init__(self):
+        self._styles = [DEFAULT_STYLE]
+        self._ids = { DEFAULT_STYLE: 0 }
+
+    def __len__(self):
+        return len(self._styles)
+
+    def __getitem__(self, style_id):
+        """ Return the attributes (as a `Char` without data) for this ID. """
+        return self._styles[style_id]
+
+    def intern(self, attrs):
+        """
+        Return the style ID for these attributes. (A `Char` instance, the
+        `data` field is ignored.)
+        """
+        if attrs.data != ' ':
+            attrs = attrs._replace(data=' ')
+
+        try:
+            return self._ids[attrs]
+        except KeyError:
+            style_id = len(self._styles)
+            self._styles.append(attrs)
+            self._ids[attrs] = style_id
+            return style_id
+
+    def replace(self, style_id, **changes):
+        """ ID of the style that we get when applying `changes` to this style. """
+        return self.intern(self._styles[style_id]._replace(**changes))
+
+
+#: Process wide style table, shared by all screens. Sharing one table means
+#: that style IDs can be compared between panes and renderers.
+style_table = StyleTable()
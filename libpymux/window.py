@@ -14,6 +14,10 @@ class Window:
 
         self.session = None # Weakref to session added by session.add_window
 
+        # Border map, and the layout for which it was computed.
+        self._border_map = None
+        self._border_map_key = None
+
     @classmethod
     def _next_id(cls):
         cls._counter += 1
@@ -57,6 +61,42 @@ class Window:
                 self.active_pane = panes[index % len(panes)]
                 self.invalidate(Redraw.Cursor | Redraw.Borders)
 
+    def get_border_map(self, width, height):
+        """
+        Return a dict that maps the (y, x) coordinates of the border cells
+        within this size to a (border_type, is_active) tuple. `is_active` is
+        True for the border of the active pane.
+
+        The map is only computed again when the layout or the focus changed.
+        """
+        key = (width, height, self.active_pane and self.active_pane.id,
+               tuple((p.px, p.py, p.sx, p.sy) for p in self.panes))
+
+        if key != self._border_map_key:
+            border_map = {}
+
+            for pane in self.panes:
+                is_active = pane == self.active_pane
+
+                # Walk around the pane.
+                left, right = pane.px - 1, pane.px + pane.sx
+                top, bottom = pane.py - 1, pane.py + pane.sy
+                cells = [ (top, x) for x in range(left, right + 1) ] + \
+                        [ (bottom, x) for x in range(left, right + 1) ] + \
+                        [ (y, left) for y in range(top + 1, bottom) ] + \
+                        [ (y, right) for y in range(top + 1, bottom) ]
+
+                for y, x in cells:
+                    if 0 <= x < width and 0 <= y < height:
+                        border_type, active = border_map.get((y, x), (0, False))
+                        border_map[y, x] = (border_type | pane._get_border_type(x, y),
+                                            active or is_active)
+
+            self._border_map = border_map
+            self._border_map_key = key
+
+        return self._border_map
+
     def move_focus(self, direction):
         """
         Move the focus to another pane in this window.
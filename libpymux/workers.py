@@ -0,0 +1,565 @@
+"""
+Parsing of pane output in worker processes.
+
+Normally, the output of all panes is parsed in the main process, on the event
+loop. With a `WorkerPool`, the panes are divided over a few worker processes
+instead, so that busy panes can use multiple cores. A worker reads the pseudo
+terminals of its panes, feeds their output through a `BetterStream` into a
+`BetterScreen`, and sends the rows that changed to the main process. (At most
+once per `FLUSH_INTERVAL` for every pane.)
+
+In the main process, the pane has a `MirrorScreen`, that is kept up to date
+with these changes. The `Session` and the renderers use it like any other
+screen. Key strokes are still written to the pseudo terminal by the main
+process.
+"""
+from array import array
+from collections import deque
+import asyncio
+import codecs
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import struct
+import time
+
+from multiprocessing.reduction import ForkingPickler, recv_handle
+
+from pyte.screens import Margins
+
+from .history import History
+from .line import Line
+from .log import logger
+from .screen import BetterScreen
+from .stream import BetterStream
+from .styles import style_table
+
+__all__ = ('WorkerPool', 'MirrorScreen', 'FLUSH_INTERVAL')
+
+
+loop = asyncio.get_event_loop()
+
+
+#: Minimum time between two updates that a worker sends for a pane.
+FLUSH_INTERVAL = .01
+
+#: Maximum amount of bytes read from a pseudo terminal at once.
+READ_SIZE = 64 * 1024
+
+
+def _encode_line(line):
+    return line.chars.tobytes(), line.styles.tobytes()
+
+
+def _decode_line(chars, styles, style_ids=None):
+    line = Line()
+    line.chars.frombytes(chars)
+    line.styles.frombytes(styles)
+
+    if style_ids is not None:
+        line.styles = array('I', [ style_ids[s] for s in line.styles ])
+    return line
+
+
+class MirrorScreen(BetterScreen):
+    """
+    Screen of which the content is maintained by a worker process. The rows,
+    cursor, history, modes, margins, charsets and tab stops only change by
+    `apply_update`. Resizing just records the new size, the worker resizes its
+    own screen and sends the result.
+    """
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+
+        # History of the normal screen while the alternate screen is shown.
+        self._saved_history = None
+
+        # False when the output is parsed in this process again.
+        self.mirrored = True
+
+    def detach(self):
+        """
+        Stop mirroring. From now on, this screen is changed by its stream,
+        like a `BetterScreen`. (When the worker process died.)
+        """
+        self.mirrored = False
+
+        # Leaving the alternate screen brings back the normal history. (The
+        # rows of the normal screen were only known by the worker.)
+        if self._saved_history is not None:
+            self._original_screen = [ Line() for _ in range(self.lines) ]
+            self._original_screen_vars = { 'history': self._saved_history }
+            self._saved_history = None
+
+    def resize(self, lines=None, columns=None):
+        if not self.mirrored:
+            return super().resize(lines, columns)
+
+        self.lines = lines if lines is not None else self.lines
+        self.columns = columns if columns is not None else self.columns
+
+        rows = self._rows
+        del rows[self.lines:]
+        while len(rows) < self.lines:
+            rows.append(Line())
+
+        # Like the worker does. (See `BetterScreen._reset_offset_and_margins`.)
+        self.margins = Margins(0, self.lines - 1)
+        self.cursor.y = min(self.cursor.y, self.lines - 1)
+        self._mark_dirty()
+
+    def apply_update(self, cursor, mode, state, rows, history_ops, style_ids=None):
+        """
+        Apply the changes that a worker sent. (See `_WorkerPane.get_update`.)
+        `style_ids` maps the style IDs of the worker to ours, or is None when
+        they are the same.
+        """
+        for op in history_ops:
+            name = op[0]
+
+            if name == 'append':
+                for chars, styles in op[1]:
+                    self.history.append(_decode_line(chars, styles, style_ids))
+
+            elif name == 'truncate':
+                for i in range(min(op[1], len(self.history))):
+                    self.history.pop()
+                self.history.trim(op[2])
+
+            elif name == 'replace':
+                self.history.clear()
+                self.history.limit = op[1]
+                for chars, styles in op[2]:
+                    self.history.append(_decode_line(chars, styles, style_ids))
+
+            elif name == 'alternate':
+                self._saved_history = self.history
+                self.history = History(0)
+
+            elif name == 'restore':
+                self.history = self._saved_history
+                self._saved_history = None
+
+        for y, chars, styles in rows:
+            if y < self.lines:
+                self._rows[y] = _decode_line(chars, styles, style_ids)
+                self._mark_dirty(y, y + 1)
+
+        self.cursor.x, y, self.cursor.hidden, style = cursor
+        self.cursor.y = min(y, self.lines - 1)
+        self.cursor.style = style if style_ids is None else style_ids[style]
+
+        if mode is not None:
+            self.mode = set(mode)
+
+        if state is not None:
+            (top, bottom), self.charset, self.g0_charset, self.g1_charset, tabstops = state
+            self.margins = Margins(top, bottom)
+            self.tabstops = set(tabstops)
+
+
+class _WorkerPane:
+    """
+    A pane, as seen by a worker process: the pseudo terminal, the stream and
+    the screen, and what was sent to the main process already.
+    """
+    def __init__(self, pane_id, fd, lines, columns, history_limit, history_cold_threshold,
+                 history_spill):
+        self.pane_id = pane_id
+        self.fd = fd
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+        self.screen = BetterScreen(lines, columns, history_limit=history_limit,
+                                   history_cold_threshold=history_cold_threshold,
+                                   history_spill=history_spill)
+        self.stream = BetterStream()
+        self.stream.attach(self.screen)
+
+        # The history at the last update, and its counters.
+        self._history = self.screen.history
+        self._appended = self._history.appended
+        self._popped = self._history.popped
+        self._generation = self._history.generation
+
+        # (history, appended, popped, generation) of the normal screen, while
+        # the alternate screen is shown.
+        self._saved_history = None
+
+        self._mode = None
+        self._state = None
+
+    def feed(self, data):
+        self.stream.feed(self.decoder.decode(data))
+
+    def get_update(self):
+        """
+        Return the changes since the previous update: the cursor, the
+        (changed) modes, the (changed) margins, charsets and tab stops, the
+        dirty rows as (y, chars, styles) tuples and a list of history
+        operations.
+        """
+        screen = self.screen
+
+        rows = [ (y, ) + _encode_line(screen._rows[y])
+                 for y in sorted(screen.dirty) if y < screen.lines ]
+        screen.dirty.clear()
+
+        cursor = screen.cursor.x, screen.cursor.y, screen.cursor.hidden, screen.cursor.style
+
+        mode = frozenset(screen.mode)
+        if mode == self._mode:
+            mode = None
+        else:
+            self._mode = mode
+
+        state = (tuple(screen.margins), screen.charset, screen.g0_charset, screen.g1_charset,
+                 tuple(sorted(screen.tabstops)))
+        if state == self._state:
+            state = None
+        else:
+            self._state = state
+
+        return cursor, mode, state, rows, self._get_history_ops()
+
+    def _get_history_ops(self):
+        screen = self.screen
+        history = screen.history
+        ops = []
+
+        if history is not self._history:
+            saved = getattr(screen, '_original_screen_vars', {}).get('history')
+
+            if saved is self._history:
+                # Entered the alternate screen. Send the last changes of the
+                # normal history first.
+                ops.extend(self._get_history_changes(saved))
+                ops.append(('alternate', ))
+                self._saved_history = (saved, self._appended, self._popped, self._generation)
+                self._appended = history.appended
+                self._popped = history.popped
+                self._generation = history.generation
+
+            elif self._saved_history and history is self._saved_history[0]:
+                # Back from the alternate screen.
+                ops.append(('restore', ))
+                _, self._appended, self._popped, self._generation = self._saved_history
+                self._saved_history = None
+
+            else:
+                self._generation = None
+
+            self._history = history
+
+        ops.extend(self._get_history_changes(history))
+        return ops
+
+    def _get_history_changes(self, history):
+        """
+        Operations for the lines that were removed at the bottom and added to
+        this history.
+        """
+        end = history.appended - history.popped
+
+        if history.generation != self._generation:
+            # The history was cleared. Send everything.
+            ops = [ ('replace', history.limit, [ _encode_line(l) for l in history ]) ]
+        else:
+            ops = []
+
+            # Lines below the low water mark were removed, and the lines above
+            # it (if any) were appended after that. Appending can have dropped
+            # lines at the top meanwhile, so pass the amount of old lines that
+            # are left too.
+            count = min(end - history.low_water, len(history))
+
+            if history.popped != self._popped:
+                removed = self._appended - self._popped - history.low_water
+                ops.append(('truncate', removed, len(history) - count))
+
+            if count:
+                ops.append(('append', [ _encode_line(history[i])
+                                        for i in range(len(history) - count, len(history)) ]))
+
+        self._appended = history.appended
+        self._popped = history.popped
+        history.low_water = end
+        self._generation = history.generation
+        return ops
+
+
+def _run_worker(conn):
+    """
+    Main loop of a worker process. Reads the pseudo terminals and the
+    commands from the main process, and sends updates.
+    """
+    # Signals are for the main process.
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGWINCH, signal.SIG_DFL)
+
+    panes = {} # Maps file descriptors to `_WorkerPane` instances.
+    pending = set() # Panes with changes that have not been sent yet.
+    known_styles = len(style_table)
+    last_flush = 0
+
+    def send_updates():
+        nonlocal known_styles
+
+        styles = [ style_table[i] for i in range(known_styles, len(style_table)) ]
+        known_styles = len(style_table)
+
+        conn.send(('update', styles, [ (p.pane_id, ) + p.get_update() for p in pending ]))
+        pending.clear()
+
+    def remove_pane(pane):
+        pending.discard(pane)
+        del panes[pane.fd]
+        os.close(pane.fd)
+
+    while True:
+        if pending:
+            timeout = max(0, last_flush + FLUSH_INTERVAL - time.time())
+        else:
+            timeout = None
+
+        readable, _, _ = select.select([conn] + list(panes), [], [], timeout)
+
+        for fd in readable:
+            if fd is conn:
+                try:
+                    command = conn.recv()
+                except EOFError:
+                    return
+
+                name = command[0]
+
+                if name == 'add':
+                    (_, pane_id, lines, columns, history_limit, history_cold_threshold,
+                        history_spill) = command
+                    fd = recv_handle(conn)
+                    panes[fd] = pane = _WorkerPane(pane_id, fd, lines, columns, history_limit,
+                                                   history_cold_threshold, history_spill)
+                    pending.add(pane)
+
+                elif name == 'configure':
+                    _, pane_id, lines, columns, history_limit = command
+                    for pane in panes.values():
+                        if pane.pane_id == pane_id:
+                            pane.screen.resize(lines, columns)
+                            pane.screen.history.limit = history_limit
+                            pending.add(pane)
+
+                elif name == 'remove':
+                    for pane in list(panes.values()):
+                        if pane.pane_id == command[1]:
+                            remove_pane(pane)
+
+                elif name == 'stop':
+                    return
+            else:
+                pane = panes[fd]
+                try:
+                    data = os.read(fd, READ_SIZE)
+                except OSError:
+                    data = b''
+
+                if data:
+                    try:
+                        pane.feed(data)
+                    except Exception:
+                        logger.exception('Parsing the output of pane %r failed.' % pane.pane_id)
+                    pending.add(pane)
+                else:
+                    # The process in the pane was terminated.
+                    if pane in pending:
+                        send_updates()
+                    remove_pane(pane)
+
+        if pending and time.time() >= last_flush + FLUSH_INTERVAL:
+            send_updates()
+            last_flush = time.time()
+
+
+class _Worker:
+    """
+    Main process side of a worker process.
+
+    Commands are queued and written when the pipe is writable, so that the
+    event loop never blocks on a worker that is busy sending updates. They
+    are framed like `Connection.send` does, and file descriptors are passed
+    like `send_handle` does, so the worker receives them with `recv` and
+    `recv_handle`.
+    """
+    def __init__(self, on_update, on_exit):
+        self._on_update = on_update
+        self._on_exit = on_exit
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.panes = {} # Maps pane IDs to panes.
+
+        # Maps style IDs of the worker to ours. The worker inherits the style
+        # table as it is now.
+        self._style_ids = list(range(len(style_table)))
+        self._same_styles = True
+
+        context = multiprocessing.get_context('fork')
+        self.process = context.Process(target=_run_worker, args=(child_conn, ), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        # Queued commands (bytes) and file descriptors (int).
+        self._socket = socket.fromfd(self.conn.fileno(), socket.AF_UNIX, socket.SOCK_STREAM)
+        self._output = deque()
+        self._writing = False
+
+        loop.add_reader(self.conn.fileno(), self._receive)
+
+    def send(self, *command):
+        data = ForkingPickler.dumps(command)
+        self._output.append(memoryview(struct.pack('!i', len(data)) + data))
+        self._write_ready()
+
+    def _send_handle(self, fd):
+        self._output.append(fd)
+        self._write_ready()
+
+    def _write_ready(self):
+        """ Write as much of the queued output as possible, without blocking. """
+        output = self._output
+
+        try:
+            while output:
+                item = output[0]
+
+                if isinstance(item, int):
+                    self._socket.sendmsg([b'\x01'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                                      array('i', [item]))], socket.MSG_DONTWAIT)
+                    output.popleft()
+                else:
+                    size = self._socket.send(item, socket.MSG_DONTWAIT)
+                    if size == len(item):
+                        output.popleft()
+                    else:
+                        output[0] = item[size:]
+
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            # The worker is gone. `_receive` notices that.
+            logger.error('Sending to worker process %r failed: %r' % (self.process.pid, e))
+            output.clear()
+
+        if output and not self._writing:
+            loop.add_writer(self.conn.fileno(), self._write_ready)
+            self._writing = True
+
+        elif not output and self._writing:
+            loop.remove_writer(self.conn.fileno())
+            self._writing = False
+
+    def _close(self):
+        loop.remove_reader(self.conn.fileno())
+        if self._writing:
+            loop.remove_writer(self.conn.fileno())
+            self._writing = False
+
+        self._output.clear()
+        self._socket.close()
+        self.conn.close()
+
+    def add_pane(self, pane):
+        self.panes[pane.id] = pane
+        history = pane.screen.history
+        self.send('add', pane.id, pane.screen.lines, pane.screen.columns,
+                  history.limit, history.cold_threshold, history.spill)
+        self._send_handle(pane.master)
+
+    def _receive(self):
+        while self.conn.poll():
+            try:
+                _, styles, updates = self.conn.recv()
+            except EOFError:
+                logger.error('Worker process %r terminated.' % self.process.pid)
+                self._close()
+                self._on_exit(self)
+                return
+
+            for attrs in styles:
+                style_id = style_table.intern(attrs)
+                if style_id != len(self._style_ids):
+                    self._same_styles = False
+                self._style_ids.append(style_id)
+
+            style_ids = None if self._same_styles else self._style_ids
+
+            for pane_id, cursor, mode, state, rows, history_ops in updates:
+                pane = self.panes.get(pane_id)
+                if pane:
+                    pane.screen.apply_update(cursor, mode, state, rows, history_ops, style_ids)
+                    self._on_update(pane)
+
+    def stop(self):
+        # When 'stop' can't be written now, the worker stops at the end of
+        # the pipe instead.
+        self.send('stop')
+        self._close()
+        self.process.join()
+
+
+class WorkerPool:
+    """
+    Worker processes that parse the output of panes. Every pane is assigned
+    to the worker that has the fewest panes.
+
+    Create the pool before the panes, the workers are forked and inherit the
+    open file descriptors. When a worker dies, its panes are parsed in the
+    main process again.
+
+    :param processes: Amount of worker processes. (Default: amount of CPUs.)
+    """
+    def __init__(self, processes=None):
+        self.processes = processes or os.cpu_count() or 1
+        self._workers = [ _Worker(self._pane_updated, self._worker_exited)
+                          for _ in range(self.processes) ]
+
+    def _get_worker(self, pane):
+        for worker in self._workers:
+            if pane.id in worker.panes:
+                return worker
+
+    def add_pane(self, pane):
+        """ Start reading the output of this pane in a worker. """
+        if not self._workers:
+            pane.detach_worker()
+            return
+
+        worker = min(self._workers, key=lambda w: len(w.panes))
+        worker.add_pane(pane)
+
+    def configure_pane(self, pane):
+        """ Pass the size and history limit of this pane to its worker. """
+        worker = self._get_worker(pane)
+        if worker:
+            worker.send('configure', pane.id, pane.screen.lines, pane.screen.columns,
+                        pane.screen.history.limit)
+
+    def remove_pane(self, pane):
+        worker = self._get_worker(pane)
+        if worker:
+            del worker.panes[pane.id]
+            worker.send('remove', pane.id)
+
+    def stop(self):
+        for worker in self._workers:
+            worker.stop()
+
+    def _pane_updated(self, pane):
+        pane.invalidate()
+
+    def _worker_exited(self, worker):
+        self._workers.remove(worker)
+
+        for pane in list(worker.panes.values()):
+            pane.detach_worker()
+        worker.panes.clear()
@@ -4,8 +4,13 @@ import asyncio_amp
 # From server to client.
 
 class WriteOutput(asyncio_amp.Command):
+    """
+    Output for the terminal. A frame that doesn't fit in one value is sent in
+    several chunks, `more` is True for all but the last chunk.
+    """
     arguments = [
         ('data', asyncio_amp.Bytes()),
+        ('more', asyncio_amp.Boolean()),
     ]
     response = [ ]
 
@@ -17,7 +22,15 @@ class DetachClient(asyncio_amp.Command):
 # from client to server.
 
 class AttachClient(asyncio_amp.Command):
-    arguments = [ ]
+    """
+    Attach to the session. `synchronized_output` and `repeat` tell whether
+    the terminal of the client understands synchronized updates (DEC mode
+    2026) and REP.
+    """
+    arguments = [
+        ('synchronized_output', asyncio_amp.Boolean()),
+        ('repeat', asyncio_amp.Boolean()),
+    ]
     response = [ ]
 
 class SendKeyStrokes(asyncio_amp.Command):
@@ -47,3 +60,28 @@ class GetSessionInfo(asyncio_amp.Command):
 
 class NewWindow(asyncio_amp.Command):
     pass
+
+class SearchPane(asyncio_amp.Command):
+    """
+    Search the scrollback of the active pane. The response is the match as
+    JSON: {"line": ..., "start": ..., "end": ...}, or null. For an invalid
+    regular expression, it's {"error": ...}.
+    """
+    arguments = [
+        ('pattern', asyncio_amp.String()),
+        ('regex', asyncio_amp.Boolean()),
+        ('ignore_case', asyncio_amp.Boolean()),
+        ('backwards', asyncio_amp.Boolean()),
+    ]
+    response = [
+        ('text', asyncio_amp.String()),
+    ]
+
+class SearchNext(asyncio_amp.Command):
+    """ Next match of the last `SearchPane` command. """
+    arguments = [
+        ('reverse', asyncio_amp.Boolean()),
+    ]
+    response = [
+        ('text', asyncio_amp.String()),
+    ]
@@ -1,6 +1,7 @@
 from libpymux.session import Session
 from libpymux.log import logger
 from libpymux.window import Window
+from libpymux.workers import WorkerPool
 
 from pymux.panes import BashPane
 
@@ -9,8 +10,17 @@ import concurrent
 
 
 class PyMuxSession(Session):
-    def __init__(self):
+    """
+    :param worker_processes: When given, parse the output of the panes in
+        this amount of worker processes.
+    """
+    def __init__(self, worker_processes=0):
         super().__init__()
+
+        # Fork the workers before creating any pane.
+        if worker_processes:
+            self.worker_pool = WorkerPool(worker_processes)
+
         self.pane_executor = concurrent.futures.ThreadPoolExecutor(1024)
         self.pane_runners = [ ] # Futures
 
@@ -22,13 +32,13 @@ class PyMuxSession(Session):
         window = Window()
         self.add_window(window)
 
-        pane = BashPane(self.pane_executor)
+        pane = BashPane(self.pane_executor, **self.get_pane_options())
         window.add_pane(pane)
         self._run_pane(window, pane)
 
 
     def split_pane(self, vsplit):
-        pane = BashPane(self.pane_executor)
+        pane = BashPane(self.pane_executor, **self.get_pane_options())
         self.active_window.add_pane(pane, vsplit=vsplit)
         self._run_pane(self.active_window, pane)
 
@@ -78,3 +88,6 @@ class PyMuxSession(Session):
 
             else:
                 break
+
+        if self.worker_pool:
+            self.worker_pool.stop()
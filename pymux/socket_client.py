@@ -26,13 +26,25 @@ class ClientProtocol(asyncio_amp.AMPProtocol):
         self._write = output_transport.write
         self._detach_callback = detach_callback
 
+        # Chunks of the output that is being received.
+        self._output = bytearray()
+
     def connection_made(self, transport):
         super().connection_made(transport)
         self.send_size()
 
     @WriteOutput.responder
-    def _write_output(self, data):
-        self._write(data)
+    def _write_output(self, data, more):
+        # Write every frame at once, so that the terminal doesn't display it
+        # partially drawn.
+        if more or self._output:
+            self._output.extend(data)
+
+            if not more:
+                self._write(bytes(self._output))
+                self._output.clear()
+        else:
+            self._write(data)
 
     @DetachClient.responder
     def _detach_client(self):
@@ -55,7 +67,7 @@ class InputProtocol(BaseProtocol):
 
 
 @asyncio.coroutine
-def _run():
+def _run(synchronized_output, repeat):
     f = asyncio.Future()
 
     output_transport, output_protocol = yield from loop.connect_write_pipe(
@@ -79,14 +91,20 @@ def _run():
     with alternate_screen(output_transport.write):
         with raw_mode(0):
             # Tell the server that we want to attach to the session
-            yield from protocol.call_remote(AttachClient)
+            yield from protocol.call_remote(AttachClient, synchronized_output=synchronized_output,
+                                            repeat=repeat)
 
             # Run loop and wait for detach command
             yield from f
 
 
-def start_client():
-    loop.run_until_complete(_run())
+def start_client(synchronized_output=False, repeat=False):
+    """
+    :param synchronized_output: True when the terminal understands
+        synchronized updates. (DEC mode 2026.)
+    :param repeat: True when the terminal understands REP.
+    """
+    loop.run_until_complete(_run(synchronized_output, repeat))
 
 
 if __name__ == '__main__':
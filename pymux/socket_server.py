@@ -7,13 +7,16 @@ import asyncio_amp
 import logging
 import weakref
 import json
+import re
 
 from pymux.session import PyMuxSession
-from pymux.amp_commands import WriteOutput, SendKeyStrokes, GetSessions, SetSize, DetachClient, AttachClient, GetSessionInfo, NewWindow
+from pymux.amp_commands import WriteOutput, SendKeyStrokes, GetSessions, SetSize, DetachClient, AttachClient, GetSessionInfo, NewWindow, SearchPane, SearchNext
 from pymux.input import PyMuxInputProtocol
 from pymux.renderer import AmpRenderer
 
 from libpymux.log import logger
+from libpymux.renderer import get_style_transition
+from libpymux.screen import apply_sgr
 
 
 loop = asyncio.get_event_loop()
@@ -57,9 +60,11 @@ class ServerProtocol(asyncio_amp.AMPProtocol):
         self.done_callback()
 
     @AttachClient.responder
-    def _attach_client(self):
+    def _attach_client(self, synchronized_output, repeat):
         self.input_protocol = SocketServerInputProtocol(self.session, self) # TODO: pass weakref of session
         self.renderer = AmpRenderer(weakref.ref(self.session), self) # TODO: pass weakref of session
+        self.renderer.supports_synchronized_output = synchronized_output
+        self.renderer.supports_repeat = repeat
         self.session.add_renderer(self.renderer)
 
     @SendKeyStrokes.responder
@@ -81,6 +86,9 @@ class ServerProtocol(asyncio_amp.AMPProtocol):
                     "sx": pane.sx,
                     "sy": pane.sy,
                     "process_id": pane.process_id,
+                    "history_size": len(pane.screen.history),
+                    "history_limit": pane.history_limit,
+                    "memory": pane.screen.memory_usage(),
             }
 
         def get_window_info(window):
@@ -90,7 +98,11 @@ class ServerProtocol(asyncio_amp.AMPProtocol):
 
         return {
                 'text': json.dumps({
-                    "windows": { w.id: get_window_info(w) for w in self.session.windows }
+                    "windows": { w.id: get_window_info(w) for w in self.session.windows },
+                    "sgr_cache": apply_sgr.cache_info()._asdict(),
+                    "sgr_transition_cache": get_style_transition.cache_info()._asdict(),
+                    "repaint": self.session.get_repaint_stats(),
+                    "clients": self.session.get_output_stats(),
                     })
         }
 
@@ -98,14 +110,37 @@ class ServerProtocol(asyncio_amp.AMPProtocol):
     def _new_window(self):
         self.session.create_new_window()
 
+    def _match_response(self, match):
+        if match:
+            match = { "line": match.line, "start": match.start, "end": match.end }
+        return { 'text': json.dumps(match) }
+
+    @SearchPane.responder
+    def _search_pane(self, pattern, regex, ignore_case, backwards):
+        pane = self.session.active_pane
+        try:
+            match = pane and pane.search(pattern, regex=regex, ignore_case=ignore_case,
+                                         backwards=backwards)
+        except re.error as e:
+            return { 'text': json.dumps({ "error": 'Invalid regular expression: %s' % e }) }
+
+        return self._match_response(match)
+
+    @SearchNext.responder
+    def _search_next(self, reverse):
+        pane = self.session.active_pane
+        return self._match_response(pane and pane.search_next(reverse=reverse))
+
     @asyncio.coroutine
     def send_output_to_client(self, data):
-        data = data.encode('utf-8')
-
+        """
+        Send the (encoded) output of a renderer. The client writes it to the
+        terminal at once, after receiving the last chunk.
+        """
         # Send in chunks of MAX_VALUE_LENGTH
-        while data:
-            send, data = data[:MAX_VALUE_LENGTH], data[MAX_VALUE_LENGTH:]
-            result = yield from self.call_remote(WriteOutput, data=send)
+        for i in range(0, len(data), MAX_VALUE_LENGTH):
+            more = i + MAX_VALUE_LENGTH < len(data)
+            result = yield from self.call_remote(WriteOutput, data=data[i:i + MAX_VALUE_LENGTH], more=more)
 
     @asyncio.coroutine
     def detach(self):
@@ -113,8 +148,8 @@ class ServerProtocol(asyncio_amp.AMPProtocol):
 
 
 @asyncio.coroutine
-def run():
-    session = PyMuxSession()
+def run(worker_processes=0):
+    session = PyMuxSession(worker_processes=worker_processes)
     connections = []
 
     def protocol_factory():
@@ -137,8 +172,8 @@ def run():
     for c in connections:
         result = yield from c.call_remote(DetachClient)
 
-def start_server():
-    loop.run_until_complete(run())
+def start_server(worker_processes=0):
+    loop.run_until_complete(run(worker_processes))
 
 
 if __name__ == '__main__':
@@ -20,7 +20,7 @@ loop = asyncio.get_event_loop()
 
 
 @asyncio.coroutine
-def run():
+def run(synchronized_output, repeat):
     # Output transport/protocol
     output_transport, output_protocol = yield from loop.connect_write_pipe(BaseProtocol, os.fdopen(0, 'wb'))
 
@@ -30,6 +30,8 @@ def run():
             # Create session and renderer
             session = PyMuxSession()
             renderer = PipeRenderer(weakref.ref(session), output_transport.write)
+            renderer.supports_synchronized_output = synchronized_output
+            renderer.supports_repeat = repeat
             session.add_renderer(renderer)
 
             # handle resize events
@@ -42,8 +44,8 @@ def run():
             yield from session.run()
 
 
-def start_standalone():
-    loop.run_until_complete(run())
+def start_standalone(synchronized_output=False, repeat=False):
+    loop.run_until_complete(run(synchronized_output, repeat))
 
 
 if __name__ == '__main__':
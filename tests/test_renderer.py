@@ -0,0 +1,25 @@
+"""
+Erasing runs of blanks with ECH in the renderer.
+"""
+from libpymux.renderer import _can_erase
+from libpymux.styles import style_table, DEFAULT_STYLE
+
+import pytest
+
+
+@pytest.mark.parametrize('attrs', [
+    {},
+    {'bg': 'blue'},
+    {'fg': 'red', 'bold': True, 'italics': True},
+])
+def test_can_erase(attrs):
+    assert _can_erase(style_table.intern(DEFAULT_STYLE._replace(**attrs)))
+
+
+@pytest.mark.parametrize('attr', ['reverse', 'underscore', 'strikethrough'])
+def test_cannot_erase_visible_blanks(attr):
+    """ Blanks with these attributes don't look like erased cells. """
+    style_id = style_table.intern(DEFAULT_STYLE._replace(**{attr: True}))
+
+    assert getattr(style_table[style_id], attr)
+    assert not _can_erase(style_id)
@@ -0,0 +1,153 @@
+"""
+Scrolling of `BetterScreen`: IND, RI, IL and DL, with and without margins.
+"""
+from libpymux.screen import BetterScreen
+from libpymux.stream import BetterStream
+
+import pytest
+
+LINES = 5
+COLUMNS = 10
+
+
+@pytest.fixture
+def term():
+    """
+    (screen, stream) tuple. The rows of the screen contain 'l0' to 'l4', the
+    cursor is at the end of the last one.
+    """
+    screen = BetterScreen(LINES, COLUMNS)
+    stream = BetterStream()
+    stream.attach(screen)
+
+    stream.feed('\r\n'.join('l%i' % i for i in range(LINES)))
+    return screen, stream
+
+
+def rows(screen):
+    return [ screen.get_line(screen.line_offset + y).text.rstrip() for y in range(LINES) ]
+
+
+def cursor(screen):
+    return screen.cursor.y, screen.cursor.x
+
+
+def test_index_at_bottom_scrolls(term):
+    screen, stream = term
+    stream.feed('\x1bD')
+
+    assert rows(screen) == ['l1', 'l2', 'l3', 'l4', '']
+    assert [ l.text for l in screen.history ] == ['l0']
+    assert cursor(screen) == (4, 2)
+
+
+def test_index_away_from_bottom_moves_cursor(term):
+    screen, stream = term
+    stream.feed('\x1b[3;1H\x1bD')
+
+    assert rows(screen) == ['l0', 'l1', 'l2', 'l3', 'l4']
+    assert cursor(screen) == (3, 0)
+
+
+def test_index_at_bottom_margin_scrolls_region(term):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[4;1H\x1bD')
+
+    assert rows(screen) == ['l0', 'l2', 'l3', '', 'l4']
+    assert len(screen.history) == 0
+    assert cursor(screen) == (3, 0)
+
+
+def test_index_below_bottom_margin_does_not_scroll(term):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[5;1H\x1bD')
+
+    assert rows(screen) == ['l0', 'l1', 'l2', 'l3', 'l4']
+    assert cursor(screen) == (4, 0)
+
+
+def test_reverse_index_above_top_margin_does_not_scroll(term):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[1;1H\x1bM')
+
+    assert rows(screen) == ['l0', 'l1', 'l2', 'l3', 'l4']
+    assert cursor(screen) == (0, 0)
+
+
+def test_index_below_bottom_margin_moves_cursor(term):
+    screen, stream = term
+    stream.feed('\x1b[2;3r\x1b[4;1H\x1bD')
+
+    assert rows(screen) == ['l0', 'l1', 'l2', 'l3', 'l4']
+    assert cursor(screen) == (4, 0)
+
+
+def test_reverse_index_at_top(term):
+    screen, stream = term
+    stream.feed('\x1b[1;1H\x1bM')
+
+    assert rows(screen) == ['', 'l0', 'l1', 'l2', 'l3']
+    assert cursor(screen) == (0, 0)
+
+
+def test_reverse_index_at_top_margin_drops_bottom_margin_row(term):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[2;1H\x1bM')
+
+    assert rows(screen) == ['l0', '', 'l1', 'l2', 'l4']
+    assert cursor(screen) == (1, 0)
+
+
+def test_reverse_index_away_from_top_moves_cursor(term):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[3;1H\x1bM')
+
+    assert rows(screen) == ['l0', 'l1', 'l2', 'l3', 'l4']
+    assert cursor(screen) == (1, 0)
+
+
+def test_insert_lines_count_larger_than_region(term):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[3;2H\x1b[10L')
+
+    assert rows(screen) == ['l0', 'l1', '', '', 'l4']
+    assert cursor(screen) == (2, 0)
+
+
+def test_delete_lines_count_larger_than_region(term):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[3;2H\x1b[10M')
+
+    assert rows(screen) == ['l0', 'l1', '', '', 'l4']
+    assert cursor(screen) == (2, 0)
+
+
+def test_insert_lines_in_region(term):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[2;1H\x1b[L')
+
+    assert rows(screen) == ['l0', '', 'l1', 'l2', 'l4']
+
+
+def test_delete_lines_in_region(term):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[2;1H\x1b[M')
+
+    assert rows(screen) == ['l0', 'l2', 'l3', '', 'l4']
+
+
+@pytest.mark.parametrize('sequence', ['\x1b[L', '\x1b[M'])
+def test_insert_and_delete_lines_outside_region(term, sequence):
+    screen, stream = term
+    stream.feed('\x1b[2;4r\x1b[5;2H' + sequence)
+
+    assert rows(screen) == ['l0', 'l1', 'l2', 'l3', 'l4']
+    assert cursor(screen) == (4, 1)
+
+
+def test_delete_lines_resets_column(term):
+    screen, stream = term
+    stream.feed('\x1b[2;6H\x1b[M')
+
+    assert rows(screen) == ['l0', 'l2', 'l3', 'l4', '']
+    assert cursor(screen) == (1, 0)
@@ -0,0 +1,56 @@
+"""
+Searching the scrollback of a pane.
+"""
+from libpymux.panes import Pane
+from libpymux.search import SearchQuery, _required_literals
+
+import pytest
+import re
+import warnings
+
+
+@pytest.fixture
+def pane():
+    pane = Pane(history_limit=100)
+    pane.stream.feed('\r\n'.join('line %i' % i for i in range(50)))
+    return pane
+
+
+def test_search_next(pane):
+    match = pane.search('line 1')
+    assert (match.line, match.start) == (1, 0)
+
+    assert pane.search_next().line == 10
+    assert pane.search_next(reverse=True).line == 1
+
+
+def test_search_across_alternate_screen(pane):
+    assert pane.search('line 4', backwards=True).line == 49
+
+    # The alternate screen has another (empty) history. The last match
+    # doesn't apply there.
+    pane.stream.feed('\x1b[?1049h\x1b[Hline 4 on the alternate screen')
+    match = pane.search_next()
+    assert (match.line, match.start) == (0, 0)
+
+    # Back on the normal screen, the search starts over too.
+    pane.stream.feed('\x1b[?1049l')
+    assert pane.search_next().line == 49
+
+
+def test_invalid_regex(pane):
+    pane.search('line 1')
+
+    with pytest.raises(re.error):
+        pane.search('line (', regex=True)
+
+    # The previous search is kept.
+    assert pane.search_next().line == 10
+
+
+def test_required_literals():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        assert _required_literals('abc.*defg?') == ['abc', 'def']
+
+    assert SearchQuery('er+or', regex=True).search_line('an errrror') == (3, 10)
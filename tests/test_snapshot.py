@@ -0,0 +1,183 @@
+"""
+Round trips through the snapshot format of `libpymux.snapshot`.
+"""
+from libpymux import snapshot
+from libpymux.history import History
+from libpymux.line import Line
+from libpymux.panes import Pane
+from libpymux.screen import BetterScreen
+from libpymux.session import Session
+from libpymux.snapshot import (SnapshotError, SNAPSHOT_VERSION, dump_screen, load_screen,
+                               dump_session, load_session)
+from libpymux.stream import BetterStream
+from libpymux.styles import StyleTable, style_table
+from libpymux.window import Window
+
+import io
+import pytest
+import struct
+
+
+def create_screen(lines=5, columns=20, **kw):
+    screen = BetterScreen(lines, columns, **kw)
+    stream = BetterStream()
+    stream.attach(screen)
+    return screen, stream
+
+
+def round_trip(screen):
+    data = b''.join(dump_screen(screen))
+    return load_screen(io.BytesIO(data).read)
+
+
+def text(lines):
+    return [ l.text.rstrip() for l in lines ]
+
+
+def styled(lines, table=style_table):
+    """ The text and the attributes of every cell. """
+    return [ (l.text, [ table[s] for s in l.styles ]) for l in lines ]
+
+
+def test_screen_state():
+    screen, stream = create_screen()
+    stream.feed('\r\n'.join('line %i' % i for i in range(10)))
+    stream.feed('\x1b[2;4r\x1b(0\x1b[3g\x1b[1;4H\x1bH\x1b[3;5H\x1b[1;32mx\x1b[?25l')
+
+    loaded = round_trip(screen)
+
+    assert text(loaded.history) == text(screen.history)
+    assert styled(loaded._rows) == styled(screen._rows)
+    assert loaded.margins == screen.margins
+    assert loaded.g0_charset == screen.g0_charset
+    assert loaded.tabstops == screen.tabstops == {3}
+    assert loaded.mode == screen.mode
+    assert (loaded.cursor.x, loaded.cursor.y, loaded.cursor.hidden) == (5, 2, True)
+    assert loaded.cursor.attrs == screen.cursor.attrs
+
+
+def test_alternate_screen():
+    screen, stream = create_screen()
+    stream.feed('\r\n'.join('main %i' % i for i in range(8)))
+    stream.feed('\x1b[?1049h\x1b[Halternate')
+
+    loaded = round_trip(screen)
+
+    assert text(loaded._rows)[0] == 'alternate'
+    assert len(loaded.history) == 0
+    assert text(loaded._original_screen) == text(screen._original_screen)
+
+    # Leaving the alternate screen brings back the main screen and history.
+    for s in (screen, loaded):
+        s.reset_mode(1049, private=True)
+
+    assert text(loaded._rows) == text(screen._rows) == ['main %i' % i for i in range(3, 8)]
+    assert text(loaded.history) == text(screen.history)
+    assert (loaded.cursor.x, loaded.cursor.y) == (screen.cursor.x, screen.cursor.y)
+
+
+def test_history_with_cold_and_spilled_blocks():
+    screen, stream = create_screen(history_limit=1000, history_cold_threshold=10,
+                                   history_spill=True)
+    stream.feed('\r\n'.join('line %i' % i for i in range(600)))
+
+    usage = screen.history.memory_usage()
+    assert usage['spilled_bytes'] > 0
+
+    loaded = round_trip(screen)
+
+    assert text(loaded.history) == text(screen.history)
+    assert loaded.history.spill
+    assert (loaded.history.limit, loaded.history.cold_threshold) == (1000, 10)
+
+
+def test_history_state():
+    history = History(300, cold_threshold=20, spill=True)
+    for i in range(500):
+        line = Line()
+        line.write(0, 'line %i' % i, 0)
+        history.append(line)
+
+    copy = History(300, cold_threshold=20)
+    copy.set_state(*history.get_state())
+
+    assert len(copy) == 300
+    assert text(copy) == text(history)
+    assert text(copy)[0] == 'line 200'
+
+
+def test_styles_are_remapped(monkeypatch):
+    screen, stream = create_screen()
+    stream.feed('\x1b[1;31mred\x1b[0m \x1b[4;38;5;100mpalette\x1b[0m \x1b[7mreverse\r\n')
+    stream.feed('\x1b[38;2;1;2;3mtruecolour')
+    data = b''.join(dump_screen(screen))
+
+    table = StyleTable()
+    monkeypatch.setattr(snapshot, 'style_table', table)
+    loaded = load_screen(io.BytesIO(data).read)
+
+    assert styled(loaded._rows, table) == styled(screen._rows)
+    assert table[loaded.cursor.style] == screen.cursor.attrs
+
+
+def layout(container, panes):
+    """ The layout tree, with panes replaced by their index. """
+    if container in panes:
+        return panes.index(container)
+    return (type(container).__name__, list(container.sizes),
+            [ layout(c, panes) for c in container.children ])
+
+
+def test_session_with_nested_layout():
+    session = Session()
+
+    window = Window()
+    session.add_window(window)
+
+    for i, vsplit in enumerate([False, True, False]):
+        pane = window.add_pane(Pane(), vsplit=vsplit)
+        pane.stream.feed('\r\n'.join('pane %i line %i' % (i, j) for j in range(40)))
+
+    window.panes[0].parent.sizes = [3, 7]
+    session.update_size()
+
+    data = b''.join(dump_session(session))
+
+    restored = Session()
+    windows = load_session(io.BytesIO(data).read, restored, Pane)
+
+    assert len(windows) == 1
+    new = windows[0]
+
+    assert layout(new.layout, new.panes) == layout(window.layout, window.panes)
+    assert new.panes.index(new.active_pane) == window.panes.index(window.active_pane)
+
+    for old_pane, new_pane in zip(window.panes, new.panes):
+        assert (new_pane.sx, new_pane.sy) == (old_pane.sx, old_pane.sy)
+        assert text(new_pane.screen.history) == text(old_pane.screen.history)
+        assert text(new_pane.screen._rows) == text(old_pane.screen._rows)
+
+
+def test_bad_magic():
+    screen, _ = create_screen()
+    data = b''.join(dump_screen(screen))
+
+    with pytest.raises(SnapshotError):
+        load_screen(io.BytesIO(b'NOTASNAP' + data[8:]).read)
+
+
+def test_bad_version():
+    screen, _ = create_screen()
+    data = b''.join(dump_screen(screen))
+    data = data[:8] + struct.pack('<I', SNAPSHOT_VERSION + 1) + data[12:]
+
+    with pytest.raises(SnapshotError):
+        load_screen(io.BytesIO(data).read)
+
+
+def test_truncated():
+    screen, _ = create_screen()
+    data = b''.join(dump_screen(screen))
+
+    with pytest.raises(SnapshotError):
+        load_screen(io.BytesIO(data[:len(data) // 2]).read)